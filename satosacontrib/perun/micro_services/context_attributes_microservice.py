@@ -1,56 +1,42 @@
 import os
 import logging
+import threading
 
-import xml.etree.ElementTree as ET
-import requests
 from satosa.micro_services.base import ResponseMicroService
 from satosa.plugin_loader import load_backends
 from satosa.satosa_config import SATOSAConfig
 
+from satosacontrib.perun.utils.FederationMetadata import FederationMetadata
+
 logger = logging.getLogger(__name__)
 
 
 def get_idp_metadata(entity_id, federations):
-    for fed in federations:
-        file_path = "/tmp/{}.xml".format(fed.split("/")[-1])
-        if not os.path.exists(file_path):
-            fed_xml = requests.get(fed).text
-            with open(file_path, "w") as writer:
-                writer.writelines(fed_xml)
-        metadata = ET.parse(file_path).find(
-            './/{urn:oasis:names:tc:SAML:2.0:metadata}EntityDescriptor[@entityID="'
-            + entity_id
-            + '"]'
-        )
-        if metadata:
-            return metadata
+    """
+    :param entity_id: entityID of the IdP
+    :param federations: list of FederationMetadata
+    :return: UI info of the IdP from the first federation containing it
+    """
+    for federation in federations:
+        ui_info = federation.get_ui_info(entity_id)
+        if ui_info:
+            return ui_info
     return None
 
 
-text_attributes = {
-    "lang": "{http://www.w3.org/XML/1998/namespace}lang",
-    "width": "width",
-    "height": "height",
-    "text": "text",
-}
-
-
-def find_texts(metadata, element_name):
-    return [
-        {
-            attribute_key: (text.attrib[xml_key] if xml_key != "text" else text.text)
-            for (attribute_key, xml_key) in text_attributes.items()
-            if xml_key == "text" or xml_key in text.attrib
-        }
-        for text in metadata.findall(element_name)
-    ]
-
-
 class ContextAttributes(ResponseMicroService):
     def __init__(self, config, *args, **kwargs):
         super().__init__(*args, **kwargs)
         logger.info("ContextAttributes is active")
-        self.__federations = config.get("federations", [])
+        self.__federation_urls = config.get("federations", [])
+        self.__federations = [
+            FederationMetadata(
+                url,
+                config.get("metadata_dir", "/tmp"),
+                config.get("metadata_refresh_interval", 3600),
+            )
+            for url in self.__federation_urls
+        ]
         self.__federation_backends = config.get("federation_backends", [])
         self.__allowed_requesters = config.get("allowed_requesters", None)
         self.__target_backend_attribute = config.get(
@@ -59,6 +45,10 @@ class ContextAttributes(ResponseMicroService):
         self.__target_issuer_attributes = config.get(
             "target_issuer_attributes", ["targetissuer"]
         )
+        self.__backends = {}
+        self.__backend_ui_infos = {}
+        self.__backends_config_version = None
+        self.__backends_lock = threading.Lock()
 
     def process(self, context, data):
         """
@@ -76,54 +66,18 @@ class ContextAttributes(ResponseMicroService):
                     data["auth_info"]["issuer"], self.__federations
                 )
                 if metadata:
-                    data.attributes[self.__target_backend_attribute] = {
-                        "display_name": find_texts(
-                            metadata,
-                            ".//{urn:oasis:names:tc:SAML:metadata:ui}DisplayName",
-                        ),
-                        "description": find_texts(
-                            metadata,
-                            ".//{urn:oasis:names:tc:SAML:metadata:ui}Description",
-                        ),
-                        "logo": find_texts(
-                            metadata, ".//{urn:oasis:names:tc:SAML:metadata:ui}Logo"
-                        ),
-                    }
+                    data.attributes[self.__target_backend_attribute] = metadata
                 else:
                     logger.info(
                         "SP {} not found in any federation: {}".format(
-                            data["auth_info"]["issuer"], ",".join(self.__federations)
+                            data["auth_info"]["issuer"],
+                            ",".join(self.__federation_urls),
                         )
                     )
             else:
-                config_file = os.environ.get("SATOSA_CONFIG", "proxy_conf.yaml")
-                satosa_config = SATOSAConfig(config_file)
-                satosa_config["BACKEND_MODULES"] = [
-                    backend
-                    for backend in satosa_config["BACKEND_MODULES"]
-                    if backend["name"] not in self.__federation_backends
-                ]
-                backend_modules = load_backends(
-                    satosa_config, None, satosa_config["INTERNAL_ATTRIBUTES"]
-                )
-                target_backends = [
-                    backend
-                    for backend in backend_modules
-                    if backend.name == context.target_backend
-                ]
-                if target_backends:
-                    target_backend = target_backends[0]
-                    entity_descriptors = target_backend.get_metadata_desc()
-                    if entity_descriptors:
-                        entity_descriptor = entity_descriptors[0].to_dict()
-                        if (
-                            "service" in entity_descriptor
-                            and "idp" in entity_descriptor["service"]
-                            and "ui_info" in entity_descriptor["service"]["idp"]
-                        ):
-                            data.attributes[
-                                self.__target_backend_attribute
-                            ] = entity_descriptor["service"]["idp"]["ui_info"]
+                ui_info = self.__get_backend_ui_info(context.target_backend)
+                if ui_info is not None:
+                    data.attributes[self.__target_backend_attribute] = ui_info
 
             for target_issuer_attribute in self.__target_issuer_attributes:
                 data.attributes[target_issuer_attribute] = data["auth_info"]["issuer"]
@@ -131,3 +85,54 @@ class ContextAttributes(ResponseMicroService):
             logger.info("Skipping backend attributes for {}".format(data.requester))
 
         return super().process(context, data)
+
+    def __get_backend_ui_info(self, backend_name):
+        """
+        Returns UI info from metadata of a non-federation backend. Backends
+        are loaded once and loaded again only when the SATOSA config file
+        changes, UI info of each backend is computed on its first use.
+        :param backend_name: name of the backend
+        :return: UI info of the backend or None
+        """
+        config_file = os.environ.get("SATOSA_CONFIG", "proxy_conf.yaml")
+        config_version = (config_file, os.path.getmtime(config_file))
+        with self.__backends_lock:
+            if config_version != self.__backends_config_version:
+                self.__backends = self.__load_backends(config_file)
+                self.__backend_ui_infos = {}
+                self.__backends_config_version = config_version
+
+            if backend_name not in self.__backend_ui_infos:
+                backend = self.__backends.get(backend_name)
+                self.__backend_ui_infos[backend_name] = (
+                    self.__find_ui_info(backend) if backend else None
+                )
+            return self.__backend_ui_infos[backend_name]
+
+    def __load_backends(self, config_file):
+        satosa_config = SATOSAConfig(config_file)
+        satosa_config["BACKEND_MODULES"] = [
+            backend
+            for backend in satosa_config["BACKEND_MODULES"]
+            if backend["name"] not in self.__federation_backends
+        ]
+        backend_modules = load_backends(
+            satosa_config, None, satosa_config["INTERNAL_ATTRIBUTES"]
+        )
+        backends = {}
+        for backend in backend_modules:
+            backends.setdefault(backend.name, backend)
+        return backends
+
+    @staticmethod
+    def __find_ui_info(backend):
+        entity_descriptors = backend.get_metadata_desc()
+        if entity_descriptors:
+            entity_descriptor = entity_descriptors[0].to_dict()
+            if (
+                "service" in entity_descriptor
+                and "idp" in entity_descriptor["service"]
+                and "ui_info" in entity_descriptor["service"]["idp"]
+            ):
+                return entity_descriptor["service"]["idp"]["ui_info"]
+        return None
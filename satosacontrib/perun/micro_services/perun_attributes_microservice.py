@@ -1,13 +1,19 @@
 from satosa.micro_services.base import ResponseMicroService
 from perun.connector.utils.Logger import Logger
-from perun.connector.adapters.AdaptersManager import AdaptersManager
 from perun.connector.adapters.AdaptersManager import AdaptersManagerException
 from perun.connector.adapters.AdaptersManager import AdaptersManagerNotExistsException # noqa e501
 from satosa.exception import SATOSAError
 from satosa.context import Context
 from satosa.internal import InternalData
 
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
 from satosacontrib.perun.utils.ConfigStore import ConfigStore
+from satosacontrib.perun.utils.RequestCache import (
+    RequestCache,
+    RequestCachedAdaptersManager,
+)
 
 
 class PerunAttributes(ResponseMicroService):
@@ -37,9 +43,11 @@ class PerunAttributes(ResponseMicroService):
             self.__global_cfg["attrs_cfg_path"]
         )
 
-        self.__adapters_manager = AdaptersManager(
-            self.__global_cfg["adapters_manager"],
-            self.__attr_map_cfg
+        self.__adapters_manager = RequestCachedAdaptersManager(
+            AdaptersManagerRegistry.get_adapters_manager(
+                self.__global_cfg["adapters_manager"],
+                self.__attr_map_cfg
+            )
         )
 
         if not config['mode']:
@@ -52,6 +60,7 @@ class PerunAttributes(ResponseMicroService):
 
         self.__attr_map = config['attr_map']
 
+    @RequestCache.scoped
     def process(self, context: Context, data: InternalData):
 
         """
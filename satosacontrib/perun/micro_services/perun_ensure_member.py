@@ -1,12 +1,20 @@
 from perun.connector.utils.Logger import Logger
 from perun.connector.models.MemberStatusEnum import MemberStatusEnum
-from perun.connector.adapters.AdaptersManager import AdaptersManager
 from perun.connector.adapters.AdaptersManager import AdaptersManagerNotExistsException # noqa e501
 from perun.connector.adapters.AdaptersManager import AdaptersManagerException
 from satosa.micro_services.base import ResponseMicroService
 from satosa.exception import SATOSAError
 from satosa.response import Redirect
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
 from satosacontrib.perun.utils.ConfigStore import ConfigStore
+from satosacontrib.perun.utils.LookupCache import LookupCache
+from satosacontrib.perun.utils.RequestCache import (
+    RequestCache,
+    RequestCachedAdaptersManager,
+)
+from satosacontrib.perun.utils.TTLCache import TTLCache
 from satosacontrib.perun.utils.Utils import Utils
 
 
@@ -34,9 +42,26 @@ class PerunEnsureMember(ResponseMicroService):
         self.__attr_map_cfg = ConfigStore.get_attributes_map(
             self.__global_cfg["attrs_cfg_path"]
         )
-        self.__adapters_manager = AdaptersManager(
-            self.__global_cfg["adapters_manager"],
-            self.__attr_map_cfg
+        self.__adapters_manager = RequestCachedAdaptersManager(
+            AdaptersManagerRegistry.get_adapters_manager(
+                self.__global_cfg["adapters_manager"],
+                self.__attr_map_cfg
+            )
+        )
+
+        self.__registration_form_cache = LookupCache.get_instance(
+            config,
+            'registration_form_cache',
+            max_size=10000,
+            ttl=3600,
+            negative_ttl=600
+        )
+        self.__membership_cache = LookupCache.get_instance(
+            config,
+            'membership_cache',
+            max_size=10000,
+            ttl=0,
+            negative_ttl=0
         )
 
         self.__signing_cfg = self.__global_cfg["jwk"]
@@ -67,6 +92,10 @@ class PerunEnsureMember(ResponseMicroService):
 
         self.__group_name = self.__config[self.GROUP_NAME]
 
+        self.__vo_and_group_cache = TTLCache(
+            max_size=2, ttl=self.__config.get('vo_and_group_cache_ttl', 3600)
+        )
+
         self.__unauthorized_redirect_url = \
             self.__config["unauthorized_redirect_url"]
 
@@ -74,6 +103,7 @@ class PerunEnsureMember(ResponseMicroService):
 
         self.__endpoint = "/process"
 
+    @RequestCache.scoped
     def process(self, context, data):
         """
         This is where the micro service should modify the request / response.
@@ -92,117 +122,204 @@ class PerunEnsureMember(ResponseMicroService):
                                   f"before this microservice?"
             )
 
-        try:
-            vo = self.__adapters_manager.get_vo(short_name=self.__vo_short_name) # noqa
-        except (AdaptersManagerException, AdaptersManagerNotExistsException) as e:  # noqa e501
-            self.__logger.debug(e)
-            vo = None
-
+        vo = self.__get_vo()
         if not vo:
             raise SATOSAError(
                 self.LOG_PREFIX + 'VO with vo_short_name \''
                 + self.__vo_short_name + '\' not found.'
             )
 
-        self.__handle_user(user_id, vo, data, context)
+        try:
+            self.__handle_user(user_id, vo, data, context)
+        except (AdaptersManagerException, AdaptersManagerNotExistsException):
+            # the cached VO or group might not exist anymore
+            self.__vo_and_group_cache.clear()
+            raise
 
         return super().process(context, data)
 
     def __handle_user(self, user, vo, data, context):
         """
-        Handles user according to his member status
+        Handles user according to his member status. Group membership and
+        registration forms are looked up only when the decision needs them.
         @param user: current user
         @param vo: current vo
         @param data: microservice data
         @param context: microservice context
         @return: None
         """
-        is_user_in_group = not self.__group_name or self.__is_user_in_group(user, vo) # noqa e501
-        member_status = self.__adapters_manager.get_member_status_by_user_and_vo(user, vo) # noqa e501
+        member_status = self.__get_membership(
+            ('member_status', user, vo.short_name),
+            self.__adapters_manager.get_member_status_by_user_and_vo,
+            user,
+            vo,
+            is_cacheable=lambda status: status == MemberStatusEnum.VALID
+        )
+        is_user_in_group = self.__lazy(
+            lambda: not self.__group_name or self.__is_user_in_group(user, vo)
+        )
+        vo_has_registration_form = self.__lazy(
+            lambda: self.__vo_has_registration_form(vo)
+        )
+        group_has_registration_form = self.__lazy(
+            lambda: self.__group_has_registration_form(vo)
+        )
 
-        if member_status == MemberStatusEnum.VALID and is_user_in_group:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is allowed to continue.'
-            )
+        if member_status == MemberStatusEnum.VALID:
+            if is_user_in_group():
+                self.__logger.debug(
+                    self.LOG_PREFIX + 'User is allowed to continue.'
+                )
+                return
+            if group_has_registration_form():
+                self.__logger.debug(
+                    self.LOG_PREFIX + 'User is not valid in group ' +
+                    self.__group_name + ' - sending to registration.'
+                )
+                self.register(context, data, self.__group_name)
+                return
+        elif not member_status and vo_has_registration_form():
+            if is_user_in_group():
+                self.__logger.debug(
+                    self.LOG_PREFIX + 'User is not member of vo ' +
+                    self.__vo_short_name + ' - sending to registration.'
+                )
+                self.register(context, data)
+                return
+            if group_has_registration_form():
+                self.__logger.debug(
+                    self.LOG_PREFIX + 'User is not member of vo ' +
+                    self.__vo_short_name + ' and is not in group ' +
+                    self.__group_name + ' - sending to registration.'
+                )
+                self.register(context, data, self.__group_name)
+                return
+        elif member_status == MemberStatusEnum.EXPIRED \
+                and vo_has_registration_form():
+            if is_user_in_group():
+                self.__logger.debug(
+                    self.LOG_PREFIX +
+                    'User is expired - sending to registration.'
+                )
+                self.register(context, data)
+                return
+            if group_has_registration_form():
+                self.__logger.debug(
+                    self.LOG_PREFIX + 'User is expired and not in group '
+                    + self.__group_name + ' - sending to registration.'
+                )
+                self.register(context, data, self.__group_name)
+                return
+
+        self.__logger.debug(
+            self.LOG_PREFIX + 'User is not valid in vo/group and cannot'
+            ' be sent to the registration - sending to unauthorized'
+        )
+        self.unauthorized(context, data)
 
-            return
+    @staticmethod
+    def __lazy(fetch):
+        """
+        Wraps a lookup, so that it is done on the first call only and the
+        following calls return the same result.
+        @param fetch: function doing the lookup
+        @return: function returning the result of the lookup
+        """
+        result = []
 
-        member_status = self.__adapters_manager.get_member_status_by_user_and_vo(user, vo) # noqa
-        vo_has_registration_form = \
-            self.__adapters_manager.has_registration_form_vo(vo)
-        group_has_registration_form = self.__group_has_registration_form(vo) # noqa e501
+        def get():
+            if not result:
+                result.append(fetch())
+            return result[0]
 
-        if member_status == MemberStatusEnum.VALID and is_user_in_group:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is allowed to continue.'
-            )
-        elif member_status == MemberStatusEnum.VALID \
-                and not is_user_in_group and group_has_registration_form:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is not valid in group ' +
-                self.__group_name + ' - sending to registration.'
-            )
-            self.register(context, data, self.__group_name)
-        elif not member_status and vo_has_registration_form \
-                and is_user_in_group: # noqa e501
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is not member of vo ' +
-                self.__vo_short_name + ' - sending to registration.'
-            )
-            self.register(context, data)
-        elif not member_status and vo_has_registration_form and \
-                not is_user_in_group and group_has_registration_form:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is not member of vo ' +
-                self.__vo_short_name + ' and is not in group ' +
-                self.__group_name + ' - sending to registration.'
-            )
-            self.register(context, data, self.__group_name)
-        elif member_status == MemberStatusEnum.EXPIRED \
-                and vo_has_registration_form and is_user_in_group:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is expired - sending to registration.'
-            )
-            self.register(context, data)
-        elif member_status == MemberStatusEnum.EXPIRED \
-                and not is_user_in_group and vo_has_registration_form \
-                and group_has_registration_form:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is expired and not in group '
-                + self.__group_name + ' - sending to registration.'
-            )
-            self.register(context, data, self.__group_name)
-        else:
-            self.__logger.debug(
-                self.LOG_PREFIX + 'User is not valid in vo/group and cannot'
-                ' be sent to the registration - sending to unauthorized'
-            )
-            self.unauthorized(context, data)
+        return get
 
     def __is_user_in_group(self, user, vo):
+        # the membership cache is shared with instances checking other
+        # groups, so only the answer for this group is cached
         try:
-            member_groups = self.__adapters_manager.get_groups_where_user_as_member_is_active(user, vo) # noqa
+            return self.__get_membership(
+                ('in_group', user, vo.short_name, self.__group_name),
+                self.__fetch_is_user_in_group,
+                user,
+                vo,
+                is_cacheable=bool
+            )
         except (AdaptersManagerException, AdaptersManagerNotExistsException) as e:  # noqa e501
             self.__logger.debug(e)
-            member_groups = None
+            return False
 
-        for group in member_groups:
-            if self.__group_name == group.name:
-                return True
+    def __fetch_is_user_in_group(self, user, vo):
+        member_groups = self.__adapters_manager.get_groups_where_user_as_member_is_active(user, vo) # noqa e501
+        return any(self.__group_name == group.name for group in member_groups)
+
+    def __group_has_registration_form(self, vo):
+        group = self.__get_group(vo)
+        if group is not None:
+            return self.__get_registration_form(
+                ('group', vo.short_name, group.name),
+                self.__adapters_manager.has_registration_form_group,
+                group
+            )
 
         return False
 
-    def __group_has_registration_form(self, vo):
+    def __get_membership(self, key, method, *args, is_cacheable=None):
+        if not self.__membership_cache:
+            return method(*args)
+        return self.__membership_cache.get(
+            key, lambda: method(*args), is_cacheable
+        )
+
+    def __get_vo(self):
+        return self.__get_cached_entity(
+            'vo',
+            self.__adapters_manager.get_vo,
+            short_name=self.__vo_short_name
+        )
+
+    def __get_group(self, vo):
+        return self.__get_cached_entity(
+            'group',
+            self.__adapters_manager.get_group_by_name,
+            vo,
+            self.__group_name
+        )
+
+    def __get_cached_entity(self, key, method, *args, **kwargs):
+        """
+        Returns VO or group resolved from the configuration. Found entities
+        are cached, lookups which failed or found nothing are repeated on
+        the next login.
+        @param key: cache key of the entity
+        @param method: AdaptersManager method resolving the entity
+        @return: resolved entity or None
+        """
+        entity = self.__vo_and_group_cache.get(key)
+        if entity is not None:
+            return entity
+
         try:
-            group = self.__adapters_manager.get_group_by_name(vo, self.__group_name) # noqa e501
+            entity = method(*args, **kwargs)
         except (AdaptersManagerException, AdaptersManagerNotExistsException) as e:  # noqa e501
             self.__logger.debug(e)
-            group = None
+            return None
 
-        if group is not None:
-            return self.__adapters_manager.has_registration_form_group(group) # noqa e501
+        if entity:
+            self.__vo_and_group_cache.set(key, entity)
+        return entity
 
-        return False
+    def __vo_has_registration_form(self, vo):
+        return self.__get_registration_form(
+            ('vo', vo.short_name),
+            self.__adapters_manager.has_registration_form_vo,
+            vo
+        )
+
+    def __get_registration_form(self, key, method, entity):
+        if not self.__registration_form_cache:
+            return method(entity)
+        return self.__registration_form_cache.get(key, lambda: method(entity))
 
     def register(self, context, data, group_name=None):
         """
@@ -261,6 +378,13 @@ class PerunEnsureMember(ResponseMicroService):
             self.__registration_result_url,
             self.name,
         )
+        if self.__membership_cache:
+            user_id = data.attributes.get(
+                self.__global_cfg["perun_user_id_attribute"]
+            )
+            self.__membership_cache.invalidate_where(
+                lambda key: key[1] == user_id
+            )
         return self.process(context, data)
 
     def register_endpoints(self):
@@ -1,12 +1,19 @@
 from satosa.micro_services.base import ResponseMicroService
 from perun.connector.utils.Logger import Logger
-from perun.connector.adapters.AdaptersManager import AdaptersManager
 from satosa.exception import SATOSAError
 from re import sub
 from natsort import natsorted
 from urllib.parse import quote
 
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
 from satosacontrib.perun.utils.ConfigStore import ConfigStore
+from satosacontrib.perun.utils.LookupCache import LookupCache
+from satosacontrib.perun.utils.RequestCache import (
+    RequestCache,
+    RequestCachedAdaptersManager,
+)
 
 
 def encode_entitlement(group_name):
@@ -49,10 +56,14 @@ class PerunEntitlement(ResponseMicroService):
         self.__attr_map_cfg = ConfigStore.get_attributes_map(
             self.__global_cfg["attrs_cfg_path"]
         )
-        self.__adapters_manager = AdaptersManager(
-            self.__global_cfg["adapters_manager"],
-            self.__attr_map_cfg
+        self.__adapters_manager = RequestCachedAdaptersManager(
+            AdaptersManagerRegistry.get_adapters_manager(
+                self.__global_cfg["adapters_manager"],
+                self.__attr_map_cfg
+            )
         )
+        self.__facility_cache = LookupCache.get_instance(config, 'facility_cache')
+
         if not self.__extended:
             self.__edu_person_entitlement = \
                 self.__global_cfg[self.OUTPUT_ATTR_NAME]
@@ -74,6 +85,7 @@ class PerunEntitlement(ResponseMicroService):
         self.__entitlement_authority = \
             self.__config[self.ENTITLEMENT_AUTHORITY_ATTR]
 
+    @RequestCache.scoped
     def process(self, context, data):
 
         """
@@ -254,10 +266,9 @@ class PerunEntitlement(ResponseMicroService):
                     data.data['perun']['groups']
                 )
 
-            facility_capabilities = \
-                self.__adapters_manager.get_facility_capabilities_by_rp_id(
-                   data.requester
-                )
+            facility_capabilities = self.__get_facility_capabilities(
+                data.requester
+            )
 
         except Exception as e:
             self.__logger.warning(
@@ -273,6 +284,26 @@ class PerunEntitlement(ResponseMicroService):
 
         return capabilities_result
 
+    def get_metrics(self):
+        if not self.__facility_cache:
+            return {}
+        return {
+            'facility_cache_' + name: value
+            for name, value in self.__facility_cache.metrics().items()
+        }
+
+    def __get_facility_capabilities(self, requester):
+        if not self.__facility_cache:
+            return self.__adapters_manager.get_facility_capabilities_by_rp_id(
+                requester
+            )
+        return self.__facility_cache.get(
+            ('facility_capabilities', requester),
+            lambda: self.__adapters_manager.get_facility_capabilities_by_rp_id(
+                requester
+            )
+        )
+
     def __map_group_name(self, group_name, requester):
 
         """
@@ -2,7 +2,6 @@ import logging
 from typing import List
 
 from perun.connector.adapters.AdaptersManager import (
-    AdaptersManager,
     AdaptersManagerNotExistsException,
 )
 from satosa.context import Context
@@ -11,7 +10,14 @@ from satosa.internal import InternalData
 from satosa.micro_services.base import ResponseMicroService
 from satosa.response import Redirect
 
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
 from satosacontrib.perun.utils.ConfigStore import ConfigStore
+from satosacontrib.perun.utils.RequestCache import (
+    RequestCache,
+    RequestCachedAdaptersManager,
+)
 from satosacontrib.perun.utils.Utils import Utils
 
 logger = logging.getLogger(__name__)
@@ -35,7 +41,11 @@ class PerunUser(ResponseMicroService):
         adapters_manager_cfg = global_config["adapters_manager"]
         attrs_map = ConfigStore.get_attributes_map(global_config["attrs_cfg_path"])
 
-        self.__adapters_manager = AdaptersManager(adapters_manager_cfg, attrs_map)
+        self.__adapters_manager = RequestCachedAdaptersManager(
+            AdaptersManagerRegistry.get_adapters_manager(
+                adapters_manager_cfg, attrs_map
+            )
+        )
         self.__endpoint = "/process"
         self.__signing_cfg = global_config["jwk"]
 
@@ -52,6 +62,7 @@ class PerunUser(ResponseMicroService):
         )
         return self.process(context, data)
 
+    @RequestCache.scoped
     def process(self, context: Context, data: InternalData):
         """
         Load user login from Perun for specified IdPs.
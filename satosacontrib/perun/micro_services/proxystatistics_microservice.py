@@ -1,14 +1,157 @@
+import atexit
 import logging
+import queue
+import threading
+import time
 import sqlalchemy
 from sqlalchemy.dialects.postgresql import insert
 from datetime import date
 
 from satosa.micro_services.base import ResponseMicroService
 
+from satosacontrib.perun.utils.TTLCache import TTLCache
+
 logger = logging.getLogger(__name__)
 
 
+class StatisticsWriter:
+    """
+    Collects logins in a bounded queue and writes them to the statistics
+    database from a background thread. Logins are aggregated by
+    (day, idp, sp, user) and flushed when flush_size logins are pending
+    or flush_interval seconds have passed since the last flush.
+    """
+
+    def __init__(self, save_logins, queue_size, flush_size, flush_interval):
+        self.__save_logins = save_logins
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__flush_size = flush_size
+        self.__flush_interval = flush_interval
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__stop = threading.Event()
+        self.dropped = 0
+        self.flushed = 0
+        self.last_flush_latency = 0.0
+
+        self.__thread = threading.Thread(
+            target=self.__run, name=self.__class__.__name__, daemon=True
+        )
+        self.__thread.start()
+
+    def push(self, day, idp, sp, sp_name, user):
+        """
+        Enqueues a single login without blocking.
+
+        @return: False if the queue was full or the writer was closed and
+                 the login was dropped
+        """
+        if not self.__closed:
+            try:
+                self.__queue.put_nowait((day, idp, sp, sp_name, user))
+                return True
+            except queue.Full:
+                pass
+        with self.__lock:
+            self.dropped += 1
+        state = "closed" if self.__closed else "full"
+        logger.warning(f"Statistics queue is {state}, dropping login of {user}")
+        return False
+
+    def metrics(self):
+        with self.__lock:
+            return {
+                "queue_depth": self.__queue.qsize(),
+                "dropped": self.dropped,
+                "flushed": self.flushed,
+                "last_flush_latency": self.last_flush_latency,
+            }
+
+    def close(self, timeout=None):
+        """
+        Stops the writer after all queued logins have been flushed. Logins
+        still queued after timeout seconds are counted as dropped.
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+        self.__stop.set()
+        try:
+            # wakes up the writer waiting for logins
+            self.__queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.__thread.join(timeout)
+        if not self.__thread.is_alive():
+            return
+
+        left = 0
+        try:
+            while True:
+                if self.__queue.get_nowait() is not None:
+                    left += 1
+        except queue.Empty:
+            pass
+        with self.__lock:
+            self.dropped += left
+        logger.warning(
+            f"Statistics were not written within {timeout}s, dropping "
+            f"{left} queued logins"
+        )
+
+    def __run(self):
+        logins, sp_names, pending = {}, {}, 0
+        deadline = time.monotonic() + self.__flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                item = self.__queue.get(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                item = None
+            if item is not None:
+                day, idp, sp, sp_name, user = item
+                key = (day, idp, sp, user)
+                logins[key] = logins.get(key, 0) + 1
+                sp_names[sp] = sp_name
+                pending += 1
+            stopping = self.__stop.is_set() and self.__queue.empty()
+
+            if (
+                stopping
+                or pending >= self.__flush_size
+                or time.monotonic() >= deadline
+            ):
+                if logins:
+                    self.__flush(logins, sp_names, pending)
+                logins, sp_names, pending = {}, {}, 0
+                deadline = time.monotonic() + self.__flush_interval
+
+    def __flush(self, logins, sp_names, pending):
+        start_time = time.monotonic()
+        try:
+            self.__save_logins(logins, sp_names)
+        except Exception as e:
+            with self.__lock:
+                self.dropped += pending
+            logger.warning(f"Writing {pending} logins to statistics failed: {e}")
+            return
+
+        latency = time.monotonic() - start_time
+        with self.__lock:
+            self.flushed += pending
+            self.last_flush_latency = latency
+        logger.debug(
+            f"Wrote {pending} logins in {len(logins)} rows to statistics "
+            f"in {round(latency, 3)}s"
+        )
+
+
 class ProxyStatistics(ResponseMicroService):
+    TABLES = ["statistics_per_user", "statistics_idp", "statistics_sp"]
+
     def __init__(self, config, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user_id = config["user_identificator"]
@@ -19,11 +162,81 @@ class ProxyStatistics(ResponseMicroService):
         self.port = config["stats_port"]
         self.driver = config["driver"]
         self.dialect = config["dialect"]
+
+        driver = f"+{self.driver}" if self.driver else ""
+        self.engine = sqlalchemy.create_engine(
+            f"{self.dialect}{driver}://{self.stats_user}:{self.stats_password}@{self.hostname}:{self.port}/"
+            f"{self.stats_db}",
+            pool_size=config.get("pool_size", 5),
+            max_overflow=config.get("max_overflow", 10),
+            pool_timeout=config.get("pool_timeout", 30),
+            pool_pre_ping=config.get("pool_pre_ping", True),
+            pool_recycle=config.get("pool_recycle", 3600),
+        )
+
+        self.metadata = sqlalchemy.MetaData()
+        if config.get("static_schema", False):
+            self._declare_tables()
+        else:
+            self.metadata.reflect(bind=self.engine, only=self.TABLES)
+        self.statistics_per_user = self.metadata.tables["statistics_per_user"]
+        self.statistics_idp = self.metadata.tables["statistics_idp"]
+        self.statistics_sp = self.metadata.tables["statistics_sp"]
+
+        self.returning_ids = config.get("returning_ids", True) and getattr(
+            self.engine.dialect, "full_returning", False
+        )
+        self.id_cache = TTLCache(
+            config.get("id_cache_size", 10000), config.get("id_cache_ttl", 3600)
+        )
+
+        self.writer = None
+        if config.get("async_writer", False):
+            self.writer = StatisticsWriter(
+                self._write_logins,
+                config.get("queue_size", 10000),
+                config.get("flush_size", 500),
+                config.get("flush_interval", 5),
+            )
+            atexit.register(self.writer.close, config.get("shutdown_timeout", 10))
         logger.info("ProxyStatistics are active")
 
+    def _declare_tables(self):
+        """
+        Declares the statistics tables without reflecting them from the
+        database, so that no catalog queries are needed at startup.
+        """
+        sqlalchemy.Table(
+            "statistics_per_user",
+            self.metadata,
+            sqlalchemy.Column("day", sqlalchemy.Date, primary_key=True),
+            sqlalchemy.Column("idp_id", sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column("sp_id", sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column("user", sqlalchemy.String(255), primary_key=True),
+            sqlalchemy.Column("logins", sqlalchemy.Integer, server_default="1"),
+        )
+        for side, id_column in (("idp", "idp_id"), ("sp", "sp_id")):
+            sqlalchemy.Table(
+                f"statistics_{side}",
+                self.metadata,
+                sqlalchemy.Column(id_column, sqlalchemy.Integer, primary_key=True),
+                sqlalchemy.Column("identifier", sqlalchemy.String(255), unique=True),
+                sqlalchemy.Column("name", sqlalchemy.String(255)),
+            )
+
+    def _get_cached_id(self, table, identifier, name):
+        cached = self.id_cache.get((table.name, identifier))
+        if cached is not None and (not name or cached[1] == name):
+            return cached[0]
+        return None
+
     def _get_id_from_identifier(self, cnxn, table, entity, id_column):
         identifier = entity["id"]
         name = entity["name"]
+        entity_id = self._get_cached_id(table, identifier, name)
+        if entity_id is not None:
+            return entity_id
+
         insert_stmt = insert(table).values(identifier=identifier, name=name)
         if name is None or name == "":
             insert_stmt = insert_stmt.on_conflict_do_nothing()
@@ -38,7 +251,112 @@ class ProxyStatistics(ResponseMicroService):
                 table.columns.identifier == identifier
             )
         )
-        return result.scalar()
+        entity_id = result.scalar()
+        self.id_cache.set((table.name, identifier), (entity_id, name))
+        return entity_id
+
+    def _get_ids_from_identifiers(self, cnxn, idps, sps):
+        """
+        Resolves ids of IdPs and SPs. Entities missing in the cache are
+        upserted and resolved by a single statement when the driver
+        supports RETURNING, otherwise one by one. Entities the statement
+        did not return, because a concurrent transaction inserted them,
+        are resolved one by one afterwards.
+
+        @param cnxn: database connection
+        @param idps: names of the IdPs keyed by their identifier
+        @param sps: names of the SPs keyed by their identifier
+        @return: tuple of IdP ids and SP ids keyed by identifier
+        """
+        sides = [
+            (self.statistics_idp, "idp_id", idps),
+            (self.statistics_sp, "sp_id", sps),
+        ]
+        if not self.returning_ids:
+            return tuple(
+                {
+                    identifier: self._get_id_from_identifier(
+                        cnxn, table, {"id": identifier, "name": name}, id_column
+                    )
+                    for identifier, name in entities.items()
+                }
+                for table, id_column, entities in sides
+            )
+
+        ids = {}
+        missing = {}
+        selects = []
+        for table, id_column, entities in sides:
+            ids[table.name] = {}
+            missing[table.name] = {}
+            for identifier, name in entities.items():
+                entity_id = self._get_cached_id(table, identifier, name)
+                if entity_id is None:
+                    missing[table.name][identifier] = name
+                else:
+                    ids[table.name][identifier] = entity_id
+            if missing[table.name]:
+                selects += self._upsert_returning_selects(
+                    table, id_column, missing[table.name]
+                )
+
+        if selects:
+            for table_name, identifier, entity_id in cnxn.execute(
+                sqlalchemy.union_all(*selects)
+            ):
+                ids[table_name][identifier] = entity_id
+                self.id_cache.set(
+                    (table_name, identifier),
+                    (entity_id, missing[table_name][identifier]),
+                )
+
+        # the fallback select uses the snapshot of the statement, so it misses
+        # rows committed meanwhile by a concurrent insert of the same entity
+        for table, id_column, entities in sides:
+            for identifier, name in missing[table.name].items():
+                if identifier not in ids[table.name]:
+                    ids[table.name][identifier] = self._get_id_from_identifier(
+                        cnxn, table, {"id": identifier, "name": name}, id_column
+                    )
+
+        return ids[self.statistics_idp.name], ids[self.statistics_sp.name]
+
+    def _upsert_returning_selects(self, table, id_column, entities):
+        """
+        Builds selects of (table name, identifier, id) backed by an upsert
+        in a CTE. Names are only updated when a non-empty name is given,
+        otherwise the conflict is ignored. Ignored rows are not returned
+        by RETURNING, so these are also selected from the table.
+        """
+        columns = [table.columns.identifier, table.columns[id_column]]
+        # literals get unique bind names, so both sides fit into a statement
+        insert_stmt = insert(table).values(
+            [
+                {
+                    "identifier": sqlalchemy.literal(identifier),
+                    "name": sqlalchemy.literal(name),
+                }
+                for identifier, name in entities.items()
+            ]
+        )
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=["identifier"],
+            set_=dict(name=insert_stmt.excluded.name),
+            where=insert_stmt.excluded.name != "",
+        )
+        upserted = insert_stmt.returning(*columns).cte(f"{table.name}_upserted")
+
+        selects = [
+            sqlalchemy.select(sqlalchemy.literal(table.name), *upserted.columns)
+        ]
+        unnamed = [identifier for identifier, name in entities.items() if not name]
+        if unnamed:
+            selects.append(
+                sqlalchemy.select(sqlalchemy.literal(table.name), *columns).where(
+                    table.columns.identifier.in_(unnamed)
+                )
+            )
+        return selects
 
     def process(self, context, internal_response):
         data = dict(internal_response)
@@ -48,45 +366,56 @@ class ProxyStatistics(ResponseMicroService):
         if sp_name is None:
             sp_name = ""
         user = data["subject_id"]
+        day = date.today().strftime("%Y-%m-%d")
 
-        if self.driver:
-            self.driver = f"+{self.driver}"
-        engine = sqlalchemy.create_engine(
-            f"{self.dialect}{self.driver}://{self.stats_user}:{self.stats_password}@{self.hostname}:{self.port}/"
-            f"{self.stats_db}"
-        )
-        cnxn = engine.connect()
-        metadata = sqlalchemy.MetaData()
-        statistics_per_user = sqlalchemy.Table(
-            "statistics_per_user", metadata, autoload=True, autoload_with=engine
-        )
-        statistics_idp = sqlalchemy.Table(
-            "statistics_idp", metadata, autoload=True, autoload_with=engine
-        )
-        statistics_sp = sqlalchemy.Table(
-            "statistics_sp", metadata, autoload=True, autoload_with=engine
-        )
+        if self.writer:
+            self.writer.push(day, idp, sp, sp_name, user)
+        else:
+            self._write_logins({(day, idp, sp, user): 1}, {sp: sp_name})
 
-        entities = {"IDP": {"id": idp, "name": ""}, "SP": {"id": sp, "name": sp_name}}
-        sides = {"IDP": statistics_idp, "SP": statistics_sp}
-        side_ids = {"IDP": "idp_id", "SP": "sp_id"}
-        ids = {}
-        for side in sides:
-            table = sides[side]
-            ids[side_ids[side]] = self._get_id_from_identifier(
-                cnxn, table, entities[side], side_ids[side]
-            )
+        logger.info(f"User {user} used IdP {idp} to log into SP {sp}")
+
+        return super().process(context, internal_response)
 
-        fields = {"day": date.today().strftime("%Y-%m-%d"), "logins": 1, "user": user}
-        fields.update(ids)
+    def _write_logins(self, logins, sp_names):
+        try:
+            with self.engine.begin() as cnxn:
+                self._save_logins(cnxn, logins, sp_names)
+        except Exception:
+            # ids cached inside a rolled back transaction may not exist
+            self.id_cache.clear()
+            raise
 
-        insert_stmt = insert(statistics_per_user).values(**fields)
+    def _save_logins(self, cnxn, logins, sp_names):
+        """
+        Adds logins to statistics_per_user using one multi-row upsert.
+
+        @param cnxn: database connection
+        @param logins: number of logins keyed by (day, idp, sp, user)
+        @param sp_names: display names of the SPs keyed by their identifier
+        """
+        idp_ids, sp_ids = self._get_ids_from_identifiers(
+            cnxn,
+            {idp: "" for _, idp, _, _ in logins},
+            {sp: sp_names.get(sp, "") for _, _, sp, _ in logins},
+        )
+
+        rows = [
+            {
+                "day": day,
+                "idp_id": idp_ids[idp],
+                "sp_id": sp_ids[sp],
+                "user": user,
+                "logins": count,
+            }
+            for (day, idp, sp, user), count in logins.items()
+        ]
+        insert_stmt = insert(self.statistics_per_user).values(rows)
         insert_stmt = insert_stmt.on_conflict_do_update(
             index_elements=["day", "idp_id", "sp_id", "user"],
-            set_={statistics_per_user.columns.logins: insert_stmt.excluded.logins + 1},
+            set_={
+                self.statistics_per_user.columns.logins: self.statistics_per_user.columns.logins
+                + insert_stmt.excluded.logins
+            },
         )
         cnxn.execute(insert_stmt)
-
-        logger.info(f"User {user} used IdP {idp} to log into SP {sp}")
-
-        return super().process(context, internal_response)
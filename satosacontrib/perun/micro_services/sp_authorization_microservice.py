@@ -1,7 +1,7 @@
-from typing import Union, Optional, List, Set, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional, List, Set, Callable, Iterable, Any
 
 from perun.connector.adapters.AdaptersManager import (
-    AdaptersManager,
     AdaptersManagerException,
     AdaptersManagerNotExistsException,
 )
@@ -15,8 +15,16 @@ from satosa.internal import InternalData
 from satosa.micro_services.base import ResponseMicroService
 from satosa.response import Redirect
 
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
 from satosacontrib.perun.utils.ConfigStore import ConfigStore
+from satosacontrib.perun.utils.LookupCache import LookupCache
 from satosacontrib.perun.utils.PerunConstants import PerunConstants
+from satosacontrib.perun.utils.RequestCache import (
+    RequestCache,
+    RequestCachedAdaptersManager,
+)
 from satosacontrib.perun.utils.Utils import Utils
 
 logger = Logger.get_logger(__name__)
@@ -81,15 +89,43 @@ class SpAuthorization(ResponseMicroService):
         self.__handle_unsatisfied_membership = self.__filter_config[
             self.__HANDLE_UNSATISFIED_MEMBERSHIP
         ]
+        self.__publish_user_groups = config.get("publish_user_groups", False)
 
         adapters_manager_cfg = self.__global_config["adapters_manager"]
         attrs_map = ConfigStore.get_attributes_map(
             self.__global_config["attrs_cfg_path"]
         )
-        self.__adapters_manager = AdaptersManager(
-            adapters_manager_cfg, attrs_map
+        self.__adapters_manager = RequestCachedAdaptersManager(
+            AdaptersManagerRegistry.get_adapters_manager(
+                adapters_manager_cfg, attrs_map
+            )
+        )
+        self.__facility_cache = LookupCache.get_instance(config, "facility_cache")
+        self.__registration_form_cache = LookupCache.get_instance(
+            config,
+            "registration_form_cache",
+            max_size=10000,
+            ttl=3600,
+            negative_ttl=600,
+        )
+        self.__membership_cache = LookupCache.get_instance(
+            config,
+            "membership_cache",
+            max_size=10000,
+            ttl=0,
+            negative_ttl=0,
         )
 
+        self.__lookup_executor = None
+        # opt-in, the connectors of a shared AdaptersManager are not safe
+        # to use from several threads at once
+        max_lookup_workers = config.get("max_lookup_workers", 1)
+        if max_lookup_workers > 1:
+            self.__lookup_executor = ThreadPoolExecutor(
+                max_workers=max_lookup_workers,
+                thread_name_prefix=f"{self.name}Lookup",
+            )
+
         is_missing_registration_data = not (
             self.__registration_link_attr and self.__registrar_url
         )
@@ -107,6 +143,7 @@ class SpAuthorization(ResponseMicroService):
                 "for Service defined registration link."
             )
 
+    @RequestCache.scoped
     def process(self, context: Context, data: InternalData):
         """
         Extracts user and sp entity ID from input data and checks whether user
@@ -114,7 +151,9 @@ class SpAuthorization(ResponseMicroService):
         information about user or facility is missing or can't be
         obtained, this check ends in a failure. If all the information is
         found but user isn't a member of any group, necessary info is passed
-        to the method handle_unsatisfied_membership.
+        to the method handle_unsatisfied_membership. If configured, groups of
+        the user on the facility are published in data.data['perun']['groups']
+        for the following microservices, e.g. PerunEntitlement.
 
         @param context: object for sharing proxy data through the current
                         request
@@ -132,9 +171,11 @@ class SpAuthorization(ResponseMicroService):
             )
             return self.unauthorized()
 
-        facility = self.__access_adapters_manager(
-            self.__adapters_manager.get_facility_by_rp_identifier,
-            data_requester
+        facility = self.__access_cache(
+            self.__facility_cache,
+            ("facility", data_requester),
+            self.__get_facility,
+            data_requester,
         )
 
         if not facility:
@@ -161,9 +202,12 @@ class SpAuthorization(ResponseMicroService):
             )
             return
 
-        user_groups = self.__access_adapters_manager(
+        user_groups = self.__access_cache(
+            self.__membership_cache,
+            ("facility_groups", user_id, data_requester),
             self.__adapters_manager.get_users_groups_on_facility,
-            facility, user_id
+            facility,
+            user_id,
         )
         if not user_groups:
             self.handle_unsatisfied_membership(
@@ -177,6 +221,8 @@ class SpAuthorization(ResponseMicroService):
             return
 
         logger.info("User satisfies the group membership check.")
+        if self.__publish_user_groups:
+            data.data.setdefault("perun", {})["groups"] = user_groups
         return super().process(context, data)
 
     def unauthorized(self):
@@ -294,9 +340,12 @@ class SpAuthorization(ResponseMicroService):
 
         result = {}
 
-        facility_attrs = self.__access_adapters_manager(
+        facility_attrs = self.__access_cache(
+            self.__facility_cache,
+            ("facility_attributes", facility.rp_id, tuple(attr_names)),
             self.__adapters_manager.get_facility_attributes,
-            facility, attr_names
+            facility,
+            attr_names,
         )
 
         result[self.__CHECK_GROUP_MEMBERSHIP] = facility_attrs.get(
@@ -510,10 +559,16 @@ class SpAuthorization(ResponseMicroService):
         """
         suitable_vos = set()
 
-        for vo_short_name in vo_short_names:
-            vo = self.__access_adapters_manager(
-                self.__adapters_manager.get_vo, short_name=vo_short_name
-            )
+        vos_registration_info = self.__map_lookups(
+            lambda short_name: self.__get_vo_registration_info(
+                user_id, short_name
+            ),
+            vo_short_names,
+        )
+
+        for vo_short_name, (vo, member_status, has_registration_form) in zip(
+            vo_short_names, vos_registration_info
+        ):
             if not vo:
                 logger.debug(
                     "Could not fetch VO with short na"
@@ -521,16 +576,6 @@ class SpAuthorization(ResponseMicroService):
                 )
                 continue
 
-            member_status = self.__access_adapters_manager(
-                self.__adapters_manager.get_member_status_by_user_and_vo,
-                user_id, vo
-            )
-
-            has_registration_form = self.__access_adapters_manager(
-                self.__adapters_manager.has_registration_form_by_vo_short_name,
-                vo_short_name
-            )
-
             if not member_status:
                 logger.debug(
                     "User is not a member in the VO with short name '"
@@ -581,6 +626,57 @@ class SpAuthorization(ResponseMicroService):
 
         return suitable_vos
 
+    def __get_vo_registration_info(
+        self, user_id: int, vo_short_name: str
+    ) -> tuple[Any, Optional[MemberStatusEnum], bool]:
+        """
+        Fetches VO with given short name, user's member status in it and
+        whether the VO has a registration form.
+
+        @param user_id: candidate user id for registration into VO
+        @param vo_short_name: short name of the VO
+        @return: VO, member status and registration form availability,
+                 (None, None, False) if the VO was not found
+        """
+        vo = self.__access_adapters_manager(
+            self.__adapters_manager.get_vo, short_name=vo_short_name
+        )
+        if not vo:
+            return None, None, False
+
+        member_status = self.__access_cache(
+            self.__membership_cache,
+            ("member_status", user_id, vo_short_name),
+            self.__adapters_manager.get_member_status_by_user_and_vo,
+            user_id,
+            vo,
+            is_cacheable=lambda status: status == MemberStatusEnum.VALID,
+        )
+
+        has_registration_form = self.__access_cache(
+            self.__registration_form_cache,
+            ("vo", vo_short_name),
+            self.__adapters_manager.has_registration_form_by_vo_short_name,
+            vo_short_name,
+        )
+
+        return vo, member_status, has_registration_form
+
+    def __map_lookups(self, function: Callable, items: Iterable) -> List:
+        """
+        Applies function to all items, concurrently when lookup workers
+        are configured. Results keep the order of the items and the first
+        raised exception is propagated.
+
+        @param function: lookup to perform for each item
+        @param items: arguments of the lookups
+        @return: list of lookup results
+        """
+        items = list(items)
+        if self.__lookup_executor and len(items) > 1:
+            return list(self.__lookup_executor.map(function, items))
+        return [function(item) for item in items]
+
     def __get_registration_groups(
         self, facility: Facility, vo_short_names_for_registration: Set[str]
     ) -> List[Group]:
@@ -596,24 +692,20 @@ class SpAuthorization(ResponseMicroService):
         sp_groups = self.__access_adapters_manager(
             self.__adapters_manager.get_sp_groups_by_facility, facility
         )
-        registration_data = []
-
-        for sp_group in sp_groups:
-            vo_short_name = sp_group.vo.short_name
-            group_name = sp_group.name
-
-            if vo_short_name not in vo_short_names_for_registration:
-                continue
-
-            has_registration_form = self.__access_adapters_manager(
-                self.__adapters_manager.has_registration_form_group,
-                vo_short_name
-            )
+        candidate_groups = [
+            sp_group
+            for sp_group in sp_groups
+            if sp_group.vo.short_name in vo_short_names_for_registration
+        ]
+        registration_allowed = self.__map_lookups(
+            lambda sp_group: sp_group.name == PerunConstants.GROUP_MEMBERS
+            or self.__group_has_registration_form(sp_group),
+            candidate_groups,
+        )
 
-            if (
-                group_name == PerunConstants.GROUP_MEMBERS
-                or has_registration_form
-            ):
+        registration_data = []
+        for sp_group, is_allowed in zip(candidate_groups, registration_allowed):
+            if is_allowed:
                 registration_data.append(sp_group)
                 logger.debug(
                     f"Group '{sp_group.unique_name}' added to "
@@ -629,6 +721,13 @@ class SpAuthorization(ResponseMicroService):
             self.__registration_result_url,
             self.name,
         )
+        if self.__membership_cache:
+            user_id = data.attributes.get(
+                self.__global_config["perun_user_id_attribute"]
+            )
+            self.__membership_cache.invalidate_where(
+                lambda key: key[1] == user_id
+            )
         return self.process(context, data)
 
     def register_endpoints(self):
@@ -646,6 +745,52 @@ class SpAuthorization(ResponseMicroService):
             )
         ]
 
+    def get_metrics(self) -> dict[str, int]:
+        metrics = {}
+        for cache_name, cache in [
+            ("facility_cache", self.__facility_cache),
+            ("registration_form_cache", self.__registration_form_cache),
+            ("membership_cache", self.__membership_cache),
+        ]:
+            if cache:
+                for name, value in cache.metrics().items():
+                    metrics[f"{cache_name}_{name}"] = value
+        return metrics
+
+    def __get_facility(self, rp_id: str) -> Optional[Facility]:
+        """
+        The RPC adapter raises NotExists for SPs without a facility, these
+        are returned as None, so that the negative lookup gets cached.
+        """
+        try:
+            return self.__adapters_manager.get_facility_by_rp_identifier(rp_id)
+        except AdaptersManagerNotExistsException:
+            return None
+
+    def __group_has_registration_form(self, group: Group) -> bool:
+        return self.__access_cache(
+            self.__registration_form_cache,
+            ("group", group.vo.short_name, group.name),
+            self.__adapters_manager.has_registration_form_group,
+            group,
+        )
+
+    def __access_cache(
+        self,
+        cache: Optional[LookupCache],
+        key: tuple,
+        method: Callable,
+        *args,
+        is_cacheable: Optional[Callable[[Any], bool]] = None,
+    ):
+        if not cache:
+            return self.__access_adapters_manager(method, *args)
+        return cache.get(
+            key,
+            lambda: self.__access_adapters_manager(method, *args),
+            is_cacheable,
+        )
+
     def __access_adapters_manager(self, method: Callable, *args, **kwargs):
         try:
             return method(*args, **kwargs)
@@ -1,11 +1,20 @@
 from perun.connector.utils.Logger import Logger
-from perun.connector.adapters.AdaptersManager import AdaptersManager
 from perun.connector.adapters.AdaptersManager import AdaptersManagerNotExistsException # noqa e501
 from perun.connector.adapters.AdaptersManager import AdaptersManagerException
 from satosa.micro_services.base import ResponseMicroService
 from satosa import exception
 from typing import List, Union, Any
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
 from satosacontrib.perun.utils.ConfigStore import ConfigStore
+from satosacontrib.perun.utils.Outbox import Outbox
+from satosacontrib.perun.utils.TTLCache import TTLCache
+from satosacontrib.perun.utils.WorkerPool import WorkerPool
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import hashlib
+import json
 import threading
 
 
@@ -20,6 +29,13 @@ def is_simple_type(attribute_type: type) -> bool:
            isinstance(attribute_type, int)
 
 
+def attribute_digest(value: Any) -> bytes:
+    if isinstance(value, list):
+        value = sorted(str(item) for item in value)
+    serialized = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.blake2b(serialized.encode(), digest_size=8).digest()
+
+
 def convert_to_string(
         new_value: List[Union[str, int, dict, bool, List[Any]]]
 ) -> str:
@@ -32,6 +48,10 @@ def convert_to_string(
     return attr_value_as_string
 
 
+class UserExtSourceNotFoundError(exception.SATOSAError):
+    """Raised when the user has no UES, so retrying the update cannot help"""
+
+
 class UpdateUserExtSource(ResponseMicroService):
     """
     This Satosa microservice updates
@@ -61,7 +81,7 @@ class UpdateUserExtSource(ResponseMicroService):
         )
 
         self.__perun_id_attr = self.__global_conf['perun_user_id_attribute']
-        self.__adapters_manager = AdaptersManager(
+        self.__adapters_manager = AdaptersManagerRegistry.get_adapters_manager(
             self.__global_conf["adapters_manager"],
             self.__attr_map_cfg
         )
@@ -72,6 +92,57 @@ class UpdateUserExtSource(ResponseMicroService):
         if config['append_only_attrs']:
             self.__append_only_attrs = config['append_only_attrs']
 
+        self.__worker_pool = WorkerPool(
+            self.__class__.__name__,
+            config.get('worker_count', 4),
+            config.get('queue_size', 1000),
+            config.get('overflow_policy', WorkerPool.DROP_OLDEST),
+            self.__discard_pending
+        )
+        atexit.register(
+            self.__worker_pool.close, config.get('shutdown_timeout', 10)
+        )
+
+        self.__pending_updates = {}
+        self.__pending_lock = threading.Lock()
+        self.__recent_updates = TTLCache(
+            config.get('recent_updates_size', 100000),
+            config.get('min_update_interval', 0)
+        )
+        self.__preferred_identifiers = TTLCache(
+            config.get('preferred_identifiers_size', 10000), None
+        )
+        self.__probing_executor = None
+        if config.get('parallel_identifier_probing', False):
+            self.__probing_executor = ThreadPoolExecutor(
+                max_workers=config.get('max_probing_workers', 4),
+                thread_name_prefix=self.__class__.__name__ + 'Probe'
+            )
+
+        self.__outbox = None
+        if config.get('outbox_dir'):
+            self.__outbox = Outbox(
+                config['outbox_dir'],
+                self.__class__.__name__,
+                self.__sync_journaled,
+                config.get('outbox_retry_interval', 5),
+                config.get('outbox_max_retry_interval', 600),
+                config.get('outbox_max_attempts', 20),
+                sender_count=config.get(
+                    'outbox_sender_count', config.get('worker_count', 4)
+                )
+            )
+            atexit.register(self.__outbox.close)
+
+        self.__synced_digests = TTLCache(
+            config.get('digest_store_size', 100000),
+            config.get('digest_ttl', 86400)
+        )
+        self.__last_access_updates = TTLCache(
+            config.get('last_access_store_size', 100000),
+            config.get('last_access_interval', 3600)
+        )
+
     def process(self, context, data):
 
         """
@@ -91,19 +162,130 @@ class UpdateUserExtSource(ResponseMicroService):
             'auth_info': data.auth_info
         }
 
-        threading.Thread(
-            target=self.__run,
-            args=(data_to_conversion,)
-        ).start()
+        self.__schedule_update(
+            self.__get_update_key(data), data_to_conversion
+        )
 
         return super().process(context, data)
 
+    def __get_update_key(self, data):
+
+        """
+        Builds the key used to coalesce UES updates of the same user
+        @param data: microservice data
+        @return: tuple of IdP entity ID and user identifier
+        """
+
+        issuer = data.auth_info['issuer'] if data.auth_info else None
+        identifiers = self.__config.get(
+            'user_identifiers', self.DEFAULT_CONFIG['user_identifiers']
+        )
+        for attr_name in identifiers:
+            value = data.attributes.get(attr_name)
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if value:
+                return issuer, value
+
+        return issuer, data.attributes[self.__perun_id_attr]
+
+    def __schedule_update(self, key, data_to_conversion):
+
+        """
+        Submits the UES update unless an update for the same key is already
+        waiting in the queue, in which case the waiting update takes the
+        new data, or unless the last update for the key ran less than
+        min_update_interval seconds ago. With the outbox enabled, the
+        update is stored there instead.
+        @param key: key of the update
+        @param data_to_conversion: data for the update
+        """
+
+        with self.__pending_lock:
+            if key in self.__pending_updates:
+                self.__pending_updates[key] = data_to_conversion
+                return
+            if self.__recent_updates.get(key):
+                self.__logger.debug(
+                    self.__class__.__name__ + 'Skipping UES update of '
+                    + str(key) + ', it was updated recently.'
+                )
+                return
+            if self.__outbox:
+                if self.__recent_updates.ttl:
+                    self.__recent_updates.set(key, True)
+            else:
+                self.__pending_updates[key] = data_to_conversion
+
+        if self.__outbox:
+            self.__outbox.append(
+                key,
+                dict(
+                    data_to_conversion,
+                    auth_info={
+                        'issuer': data_to_conversion['auth_info']['issuer']
+                    }
+                )
+            )
+        else:
+            self.__worker_pool.submit(self.__run_pending, key)
+
+    def __discard_pending(self, target, key):
+        with self.__pending_lock:
+            self.__pending_updates.pop(key, None)
+
+    def __run_pending(self, key):
+        with self.__pending_lock:
+            data_to_conversion = self.__pending_updates.pop(key, None)
+            if data_to_conversion is None:
+                return
+
+        # failed updates do not hold back the updates of later logins
+        if self.__sync(data_to_conversion) and self.__recent_updates.ttl:
+            self.__recent_updates.set(key, True)
+
+    def get_metrics(self):
+        """
+        Returns queue depth, drop count and latency of UES update tasks
+        """
+        metrics = self.__worker_pool.metrics()
+        if self.__outbox:
+            metrics['outbox_pending'] = self.__outbox.pending()
+        return metrics
+
     def __run(self, data_to_conversion):
 
         """
         This method runs the main logic
-        of the process on another thread
+        of the process in the worker pool
+        @param data_to_conversion: data to be modified
+        """
+
+        self.__sync(data_to_conversion)
+
+    def __sync_journaled(self, data_to_conversion):
+
+        """
+        Handler of the outbox. Updates of users without UES are final
+        failures, they are dropped instead of being retried.
+        @param data_to_conversion: data to be modified
+        @return: False if the update should be retried
+        """
+
+        try:
+            return self.__sync(data_to_conversion)
+        except UserExtSourceNotFoundError as e:
+            self.__logger.warning(
+                str(e) + ', dropping the UES update.'
+            )
+            return True
+
+    def __sync(self, data_to_conversion):
+
+        """
+        This method updates the UES with attributes from the IdP
         @param data_to_conversion: data to be modified
+        @return: False if the UES could not be updated
         """
 
         attrs_from_idp = data_to_conversion['attributes'].copy()
@@ -126,12 +308,22 @@ class UpdateUserExtSource(ResponseMicroService):
             )
 
             if not user_ext_source:
-                raise exception.SATOSAError(
+                raise UserExtSourceNotFoundError(
                     self.__class__.__name__
                     + 'No userExtSource found for IDP: '
                     + ext_source_name
                 )
 
+            digests = self.__get_attribute_digests(attr_map, attrs_from_idp)
+            if self.__synced_digests.get(user_ext_source.id) == digests:
+                self.__logger.debug(
+                    self.__class__.__name__ + 'Attributes of UES for user '
+                    'with userId: ' + str(user_id) + ' did not change '
+                    'since the last update.'
+                )
+                self.__update_last_access(user_ext_source)
+                return True
+
             attrs_from_perun = self.__get_attributes_from_perun(
                 user_ext_source
             )
@@ -147,17 +339,21 @@ class UpdateUserExtSource(ResponseMicroService):
                     user_ext_source,
                     attrs_to_update
             ):
+                self.__synced_digests.set(user_ext_source.id, digests)
                 self.__logger.debug(
                     self.__class__.__name__ + 'Updating UES for user with '
                                               'userId: ' + str(user_id)
                     + 'was successful.'
                 )
+                return True
         except KeyError:
             self.__logger.warning(
                 self.__class__.__name__ + 'Updating UES for user with userId:'
                 + ' ' + str(user_id) + 'was  not successful.'
             )
 
+        return False
+
     def __find_user_ext_source(
             self,
             ext_source_name,
@@ -166,35 +362,113 @@ class UpdateUserExtSource(ResponseMicroService):
     ):
 
         """
-        This method finds and gets UES from Perun
+        This method finds and gets UES from Perun. When no UES is found
+        and some lookup failed, the failure is raised, so that it is not
+        mistaken for a missing UES
         @param ext_source_name: name of UES
         @param attributes_from_idp: attributes from idp
         @param id_attrs: user identifiers
         @return: Optional[UES]
         """
 
-        for attr_name in attributes_from_idp:
-            if attr_name not in id_attrs:
-                continue
-
-            if not isinstance(attributes_from_idp[attr_name], list):
-                new_value = list(attributes_from_idp[attr_name])
-                attributes_from_idp[attr_name] = new_value
+        candidates = self.__get_identifier_candidates(
+            ext_source_name,
+            attributes_from_idp,
+            id_attrs
+        )
 
-            for ext_login in attributes_from_idp[attr_name]:
-                user_ext_source = self.__get_user_ext_source(
-                    ext_source_name,
-                    ext_login
+        failure = None
+        if self.__probing_executor and len(candidates) > 1:
+            futures = [
+                self.__probing_executor.submit(
+                    self.__get_user_ext_source, ext_source_name, ext_login
                 )
+                for _, ext_login in candidates
+            ]
+            try:
+                for candidate, future in zip(candidates, futures):
+                    try:
+                        user_ext_source = future.result()
+                    except AdaptersManagerException as e:
+                        failure = e
+                        continue
+                    if user_ext_source:
+                        return self.__found_user_ext_source(
+                            ext_source_name, candidate, user_ext_source
+                        )
+            finally:
+                for future in futures:
+                    future.cancel()
+        else:
+            for candidate in candidates:
+                try:
+                    user_ext_source = self.__get_user_ext_source(
+                        ext_source_name,
+                        candidate[1]
+                    )
+                except AdaptersManagerException as e:
+                    failure = e
+                    continue
                 if user_ext_source:
-                    self.__logger.debug(self.__class__.__name__ +
-                                        "Found user ext source for combination " # noqa e501
-                                        "extSourceName \'" + ext_source_name
-                                        + "\' and extLogin \'" + ext_login + "\'") # noqa e501
-                    return user_ext_source
+                    return self.__found_user_ext_source(
+                        ext_source_name, candidate, user_ext_source
+                    )
+
+        if failure:
+            raise failure
 
         return None
 
+    def __found_user_ext_source(
+            self,
+            ext_source_name,
+            candidate,
+            user_ext_source
+    ):
+        attr_name, ext_login = candidate
+        self.__preferred_identifiers.set(ext_source_name, attr_name)
+        self.__logger.debug(self.__class__.__name__ +
+                            "Found user ext source for combination "
+                            "extSourceName \'" + ext_source_name
+                            + "\' and extLogin \'" + ext_login + "\'") # noqa e501
+        return user_ext_source
+
+    def __get_identifier_candidates(
+            self,
+            ext_source_name,
+            attributes_from_idp,
+            id_attrs
+    ):
+
+        """
+        This method lists (attribute name, value) pairs of user identifiers
+        in the configured priority order. The identifier attribute that
+        matched the last time for the given IdP goes first.
+        @param ext_source_name: name of UES
+        @param attributes_from_idp: attributes from idp
+        @param id_attrs: user identifiers
+        @return: list of candidates
+        """
+
+        preferred = self.__preferred_identifiers.get(ext_source_name)
+        if preferred in id_attrs:
+            id_attrs = [preferred] + [
+                attr_name for attr_name in id_attrs if attr_name != preferred
+            ]
+
+        candidates = []
+        for attr_name in id_attrs:
+            if attr_name not in attributes_from_idp:
+                continue
+
+            values = attributes_from_idp[attr_name]
+            if not isinstance(values, list):
+                values = [values]
+
+            candidates += [(attr_name, value) for value in values]
+
+        return candidates
+
     def __get_attributes_from_perun(self, user_ext_source):
 
         """
@@ -294,6 +568,7 @@ class UpdateUserExtSource(ResponseMicroService):
             self.__adapters_manager.update_user_ext_source_last_access(
                 user_ext_source
             )
+            self.__last_access_updates.set(user_ext_source.id, True)
 
             self.__adapters_manager.set_user_ext_source_attributes(
                 user_ext_source,
@@ -305,6 +580,40 @@ class UpdateUserExtSource(ResponseMicroService):
             self.__logger.debug(e)
             return False
 
+    def __get_attribute_digests(self, attr_map, attrs_from_idp):
+
+        """
+        This method hashes the mapped attributes from the IdP, so that
+        they can be compared with the last synced ones
+        @param attr_map: mapped attributes
+        @param attrs_from_idp: attributes from idp
+        @return: dict of attribute digests
+        """
+
+        return {
+            attr_name: attribute_digest(attrs_from_idp.get(idp_attr_name))
+            for attr_name, idp_attr_name in attr_map.items()
+        }
+
+    def __update_last_access(self, user_ext_source):
+
+        """
+        This method updates UES last access at most once
+        per last_access_interval
+        @param user_ext_source: UES
+        """
+
+        if self.__last_access_updates.get(user_ext_source.id):
+            return
+
+        try:
+            self.__adapters_manager.update_user_ext_source_last_access(
+                user_ext_source
+            )
+            self.__last_access_updates.set(user_ext_source.id, True)
+        except (AdaptersManagerException, AdaptersManagerNotExistsException) as e: # noqa e501
+            self.__logger.debug(e)
+
     def __get_configuration(self):
         config = self.DEFAULT_CONFIG
         for key in config.keys():
@@ -323,5 +632,5 @@ class UpdateUserExtSource(ResponseMicroService):
             )
 
             return result
-        except (AdaptersManagerException, AdaptersManagerNotExistsException) as _: # noqa e501
+        except AdaptersManagerNotExistsException:
             return None
@@ -0,0 +1,47 @@
+import json
+import threading
+
+from perun.connector.adapters.AdaptersManager import AdaptersManager
+
+
+class AdaptersManagerRegistry:
+    """
+    Keeps one AdaptersManager per adapters configuration and attribute
+    map, so that all microservices of a worker share RPC sessions, LDAP
+    connections and the parsed attribute map.
+    """
+
+    __adapters_managers = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def get_adapters_manager(adapters_manager_cfg, attrs_map) -> AdaptersManager:
+        """
+        Returns the AdaptersManager created for the given configuration,
+        creating it on the first call.
+
+        @param adapters_manager_cfg: adapters_manager part of the global
+                                     config
+        @param attrs_map: attribute map
+        @return: shared AdaptersManager
+        """
+        key = json.dumps(
+            [adapters_manager_cfg, attrs_map], sort_keys=True, default=str
+        )
+        with AdaptersManagerRegistry.__lock:
+            adapters_manager = AdaptersManagerRegistry.__adapters_managers.get(
+                key
+            )
+            if adapters_manager is None:
+                adapters_manager = AdaptersManager(
+                    adapters_manager_cfg, attrs_map
+                )
+                AdaptersManagerRegistry.__adapters_managers[key] = (
+                    adapters_manager
+                )
+            return adapters_manager
+
+    @staticmethod
+    def clear():
+        with AdaptersManagerRegistry.__lock:
+            AdaptersManagerRegistry.__adapters_managers.clear()
@@ -0,0 +1,108 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+
+class CompiledIndex:
+    """
+    Read-only string -> JSON value map stored in a file, which is memory
+    mapped and searched without loading it, so that all processes opening
+    the same file share it through the page cache.
+
+    File layout (little endian):
+        header   magic (8 bytes), number of entries (uint32)
+        table    per entry, sorted by key: key offset (uint64), key length
+                 (uint32), value offset (uint64), value length (uint32)
+        blob     UTF-8 keys and JSON values the table points to
+    """
+
+    MAGIC = b"PRNIDX01"
+    HEADER = struct.Struct("<8sI")
+    ENTRY = struct.Struct("<QIQI")
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.__stat = os.fstat(file.fileno())
+            self.__mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.__count = self.HEADER.unpack_from(self.__mmap, 0)
+        if magic != self.MAGIC:
+            self.__mmap.close()
+            raise ValueError("{} is not a compiled index".format(path))
+
+    @staticmethod
+    def write(path, items):
+        """
+        Atomically replaces the file at path with an index of the items.
+        :param path: path of the index file
+        :param items: dict of keys and JSON serializable values
+        """
+        entries = sorted(
+            (key.encode(), json.dumps(value).encode()) for key, value in items.items()
+        )
+        blob_offset = CompiledIndex.HEADER.size + CompiledIndex.ENTRY.size * len(
+            entries
+        )
+
+        descriptor, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", suffix=".idx.tmp"
+        )
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(CompiledIndex.HEADER.pack(CompiledIndex.MAGIC, len(entries)))
+                offset = blob_offset
+                for key, value in entries:
+                    file.write(
+                        CompiledIndex.ENTRY.pack(
+                            offset, len(key), offset + len(key), len(value)
+                        )
+                    )
+                    offset += len(key) + len(value)
+                for key, value in entries:
+                    file.write(key)
+                    file.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, key, default=None):
+        """
+        Finds the key by binary search over the entry table.
+        """
+        key = key.encode()
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, value_offset, value_length = self.__entry(middle)
+            middle_key = self.__mmap[key_offset:key_offset + key_length]
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                return json.loads(self.__mmap[value_offset:value_offset + value_length])
+        return default
+
+    def is_replaced(self):
+        """
+        :return: True if the file at path is not the one this index opened
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_dev, stat.st_ino) != (self.__stat.st_dev, self.__stat.st_ino)
+
+    def close(self):
+        self.__mmap.close()
+
+    def __entry(self, position):
+        return self.ENTRY.unpack_from(
+            self.__mmap, self.HEADER.size + self.ENTRY.size * position
+        )
+
+    def __len__(self):
+        return self.__count
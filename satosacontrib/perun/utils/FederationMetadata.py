@@ -0,0 +1,298 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from email.utils import formatdate
+
+import requests
+
+from satosacontrib.perun.utils.CompiledIndex import CompiledIndex
+
+logger = logging.getLogger(__name__)
+
+MD_NAMESPACE = "urn:oasis:names:tc:SAML:2.0:metadata"
+MDUI_NAMESPACE = "urn:oasis:names:tc:SAML:metadata:ui"
+
+text_attributes = {
+    "lang": "{http://www.w3.org/XML/1998/namespace}lang",
+    "width": "width",
+    "height": "height",
+    "text": "text",
+}
+
+
+def find_texts(metadata, element_name):
+    return [
+        {
+            attribute_key: (text.attrib[xml_key] if xml_key != "text" else text.text)
+            for (attribute_key, xml_key) in text_attributes.items()
+            if xml_key == "text" or xml_key in text.attrib
+        }
+        for text in metadata.findall(element_name)
+    ]
+
+
+def extract_ui_info(entity_descriptor):
+    """
+    Extracts display names, descriptions and logos of an entity.
+    :param entity_descriptor: EntityDescriptor element
+    :return: UI info of the entity
+    """
+    return {
+        "display_name": find_texts(
+            entity_descriptor, ".//{%s}DisplayName" % MDUI_NAMESPACE
+        ),
+        "description": find_texts(
+            entity_descriptor, ".//{%s}Description" % MDUI_NAMESPACE
+        ),
+        "logo": find_texts(entity_descriptor, ".//{%s}Logo" % MDUI_NAMESPACE),
+    }
+
+
+def iter_ui_infos(source):
+    """
+    Streams entityIDs and UI info of entities from a metadata feed. Every
+    EntityDescriptor is discarded once its UI info is extracted, so only
+    one entity is held in memory at a time.
+    :param source: file name or file object with the metadata feed
+    :return: iterator of (entityID, UI info) pairs
+    """
+    entity_descriptor_tag = "{%s}EntityDescriptor" % MD_NAMESPACE
+    parents = []
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag != entity_descriptor_tag:
+            continue
+
+        entity_id = element.attrib.get("entityID")
+        if entity_id:
+            yield entity_id, extract_ui_info(element)
+        element.clear()
+        if parents:
+            # drop the processed entities from the enclosing EntitiesDescriptor
+            parents[-1].clear()
+
+
+class FederationMetadata:
+    """
+    UI info of entities of a federation metadata feed, indexed by entityID.
+
+    The feed is stored in metadata_dir and compiled into an index file
+    next to it, which is memory mapped and shared by all workers. The
+    index is opened on the first lookup, the feed is downloaded and
+    compiled first if needed. With refresh_interval,
+    a background thread provides the first index and then downloads the
+    feed again using conditional requests (ETag, If-Modified-Since),
+    builds a new index and swaps it in. Lookups miss until the first
+    index is ready, then they keep using the last good index meanwhile
+    and when the refresh fails.
+
+    Workers sharing metadata_dir download and compile the feed one at a
+    time, guarded by a lock file, and share the validators of the last
+    download in a file next to the feed, so that a worker whose
+    conditional request is answered by 304 picks up the index compiled
+    by another worker.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, url, metadata_dir="/tmp", refresh_interval=None, timeout=60):
+        self.url = url
+        self.file_path = os.path.join(
+            metadata_dir, "{}.xml".format(url.split("/")[-1])
+        )
+        base_path = os.path.splitext(self.file_path)[0]
+        self.index_path = base_path + ".idx"
+        self.lock_path = base_path + ".lock"
+        self.validators_path = base_path + ".validators"
+        self.__metadata_dir = metadata_dir
+        self.__timeout = timeout
+        self.__index = None
+        self.__lock = threading.Lock()
+
+        self.__stop = threading.Event()
+        self.__refresher = None
+        if refresh_interval:
+            self.__refresher = threading.Thread(
+                target=self.__refresh_periodically,
+                args=(refresh_interval,),
+                name="FederationMetadataRefresher",
+                daemon=True,
+            )
+            self.__refresher.start()
+
+    def get_ui_info(self, entity_id):
+        """
+        :param entity_id: entityID of the entity
+        :return: UI info of the entity or None, if it is not in the feed
+                 or the feed is not available yet
+        """
+        index = self.__get_index()
+        return index.get(entity_id) if index else None
+
+    def refresh(self):
+        """
+        Downloads the feed if it changed since the last download and swaps
+        in a new index built from it. When the feed did not change, an
+        index compiled meanwhile by another process is picked up.
+        :return: True if a new index was built
+        """
+        with self.__lock:
+            # an index on disk is served while other workers hold the lock
+            if self.__index is None:
+                self.__index = self.__open_index()
+            with self.__locked_files():
+                if self.__index is None:
+                    self.__index = self.__open_index()
+                if self.__index is None and os.path.exists(self.file_path):
+                    self.__index = self.__build_index(self.file_path)
+                if self.__download():
+                    return True
+                if self.__index is None or self.__index.is_replaced():
+                    self.__index = self.__open_index() or self.__index
+                return False
+
+    def close(self):
+        """
+        Stops the background refresher.
+        """
+        self.__stop.set()
+        if self.__refresher:
+            self.__refresher.join()
+
+    def __get_index(self):
+        if self.__index is None and self.__refresher:
+            # requests do not wait for the download done by the refresher
+            return None
+        if self.__index is None:
+            with self.__lock:
+                if self.__index is None:
+                    self.__index = self.__open_index()
+                if self.__index is None:
+                    with self.__locked_files():
+                        self.__index = self.__open_index()
+                        if self.__index is None and not os.path.exists(
+                            self.file_path
+                        ):
+                            self.__download()
+                        if self.__index is None:
+                            self.__index = self.__build_index(self.file_path)
+        return self.__index
+
+    @contextlib.contextmanager
+    def __locked_files(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __read_validators(self):
+        try:
+            with open(self.validators_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def __write_validators(self, validators):
+        descriptor, tmp_path = tempfile.mkstemp(
+            dir=self.__metadata_dir, suffix=".validators.tmp"
+        )
+        try:
+            with os.fdopen(descriptor, "w") as writer:
+                json.dump(validators, writer)
+            os.replace(tmp_path, self.validators_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def __open_index(self):
+        if not os.path.exists(self.index_path):
+            return None
+        if os.path.exists(self.file_path) and os.path.getmtime(
+            self.index_path
+        ) < os.path.getmtime(self.file_path):
+            return None
+        try:
+            return CompiledIndex(self.index_path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("Opening {} failed: {}".format(self.index_path, e))
+            return None
+
+    def __refresh_periodically(self, refresh_interval):
+        while not self.__stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(
+                    "Refreshing metadata from {} failed: {}".format(self.url, e)
+                )
+            self.__stop.wait(refresh_interval)
+
+    def __download(self):
+        headers = {}
+        validators = {}
+        if os.path.exists(self.file_path):
+            validators = self.__read_validators()
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        elif os.path.exists(self.file_path):
+            headers["If-Modified-Since"] = formatdate(
+                os.path.getmtime(self.file_path), usegmt=True
+            )
+
+        # the feed is streamed to disk, it is never held in memory as a whole
+        with requests.get(
+            self.url, headers=headers, timeout=self.__timeout, stream=True
+        ) as response:
+            if response.status_code == 304:
+                logger.debug("Metadata from {} did not change".format(self.url))
+                return False
+            response.raise_for_status()
+
+            descriptor, tmp_path = tempfile.mkstemp(
+                dir=self.__metadata_dir, suffix=".xml.tmp"
+            )
+            try:
+                with os.fdopen(descriptor, "wb") as writer:
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        writer.write(chunk)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+        try:
+            index = self.__build_index(tmp_path)
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.__index = index
+        self.__write_validators(
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        )
+        return True
+
+    def __build_index(self, file_path):
+        index = {}
+        for entity_id, ui_info in iter_ui_infos(file_path):
+            if entity_id not in index:
+                index[entity_id] = ui_info
+        CompiledIndex.write(self.index_path, index)
+        logger.info("Indexed {} entities from {}".format(len(index), self.url))
+        return CompiledIndex(self.index_path)
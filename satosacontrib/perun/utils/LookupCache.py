@@ -0,0 +1,99 @@
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+from satosacontrib.perun.utils.TTLCache import TTLCache
+
+
+class LookupCache:
+    """
+    Process-wide cache of Perun lookups, shared by all microservices
+    configured with the same cache options. Empty results (e.g. an SP
+    without a facility) are cached as well, with their own TTL, unless
+    the negative TTL is 0. Failed lookups are not cached.
+    """
+
+    __instances = {}
+    __lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl: Optional[float] = 300,
+        negative_ttl: Optional[float] = 60,
+    ):
+        self.__cache = TTLCache(max_size, ttl)
+        self.__negative_ttl = negative_ttl
+
+    @staticmethod
+    def get_instance(
+        config: dict[str, Any],
+        prefix: str,
+        max_size: int = 1000,
+        ttl: float = 300,
+        negative_ttl: float = 60,
+    ) -> Optional["LookupCache"]:
+        """
+        Returns the cache shared by microservices with the same options or
+        None, if the cache is disabled. The options are read from config
+        as <prefix>_size, <prefix>_ttl and <prefix>_negative_ttl, TTL 0
+        disables the cache.
+
+        @param config: microservice configuration
+        @param prefix: prefix of the cache options, e.g. 'facility_cache'
+        @param max_size: default maximal number of cached lookups
+        @param ttl: default time to live of cached results
+        @param negative_ttl: default time to live of empty results
+        @return: shared lookup cache or None
+        """
+        ttl = config.get(f"{prefix}_ttl", ttl)
+        if not ttl:
+            return None
+        options = (
+            config.get(f"{prefix}_size", max_size),
+            ttl,
+            config.get(f"{prefix}_negative_ttl", negative_ttl),
+        )
+        with LookupCache.__lock:
+            key = (prefix, *options)
+            if key not in LookupCache.__instances:
+                LookupCache.__instances[key] = LookupCache(*options)
+            return LookupCache.__instances[key]
+
+    def get(
+        self,
+        key: tuple[Hashable, ...],
+        loader: Callable[[], Any],
+        is_cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Returns the cached result of a lookup or the result of loader().
+
+        @param key: type of the lookup, RP entity id and other arguments
+                    the result depends on, e.g. ('facility', rp_id)
+        @param loader: function performing the lookup in Perun
+        @param is_cacheable: decides whether a loaded result is cached,
+                             all results are cached by default
+        @return: result of the lookup
+        """
+        value = self.__cache.get(key, TTLCache.MISSING)
+        if value is TTLCache.MISSING:
+            value = loader()
+            if is_cacheable and not is_cacheable(value):
+                return value
+            if value:
+                self.__cache.set(key, value)
+            elif self.__negative_ttl:
+                self.__cache.set(key, value, self.__negative_ttl)
+        return value
+
+    def invalidate_where(self, predicate: Callable[[tuple], bool]):
+        """
+        Removes all cached lookups whose key matches the predicate.
+        """
+        self.__cache.invalidate_where(predicate)
+
+    def clear(self):
+        self.__cache.clear()
+
+    def metrics(self) -> dict[str, int]:
+        return self.__cache.metrics()
@@ -0,0 +1,200 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+from perun.connector.utils.Logger import Logger
+
+
+class Outbox:
+    """
+    Durable queue of tasks stored in a SQLite journal. Appended payloads
+    are passed to the handler by a background sender. A payload is
+    removed when the handler returns True, otherwise it is retried with
+    exponential backoff until max_attempts is reached.
+
+    Payloads appended with the same key replace each other while they
+    wait. A payload replaced while it is being sent keeps the lease and
+    is sent once the previous one finishes, so updates of the same key
+    never overtake each other. Senders claim payloads with a lease, so several processes can
+    share one journal and payloads of a crashed process are replayed
+    once their lease expires. With sender_count > 1, several senders of
+    the process deliver payloads concurrently.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        name: str,
+        handler: Callable[[Any], bool],
+        retry_interval: float = 5,
+        max_retry_interval: float = 600,
+        max_attempts: int = 20,
+        lease_time: float = 300,
+        batch_size: int = 50,
+        sender_count: int = 1,
+    ):
+        self.__logger = Logger.get_logger(self.__class__.__name__)
+        self.__name = name
+        self.__handler = handler
+        self.__retry_interval = retry_interval
+        self.__max_retry_interval = max_retry_interval
+        self.__max_attempts = max_attempts
+        self.__lease_time = lease_time
+        # senders claim smaller batches, so a backlog is spread among them
+        self.__batch_size = max(1, batch_size // max(1, sender_count))
+
+        os.makedirs(directory, exist_ok=True)
+        self.__connection = sqlite3.connect(
+            os.path.join(directory, f"{name}.sqlite"),
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.__lock = threading.Lock()
+        with self.__lock:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "key TEXT UNIQUE, "
+                "payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "next_attempt REAL NOT NULL)"
+            )
+
+        self.__wakeup = threading.Event()
+        self.__stop = threading.Event()
+        self.__senders = [
+            threading.Thread(
+                target=self.__send, name=f"{name}Outbox-{i}", daemon=True
+            )
+            for i in range(max(1, sender_count))
+        ]
+        for sender in self.__senders:
+            sender.start()
+
+    def append(self, key: Hashable, payload: Any):
+        """
+        Stores the payload in the journal. A waiting payload with the same
+        key is replaced.
+        """
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT INTO outbox (key, payload, next_attempt) "
+                "VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET payload = excluded.payload",
+                (
+                    json.dumps(key, default=str),
+                    json.dumps(payload, default=str),
+                    time.time(),
+                ),
+            )
+        self.__wakeup.set()
+
+    def pending(self) -> int:
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT COUNT(*) FROM outbox"
+            ).fetchone()[0]
+
+    def close(self, timeout: float = 10):
+        """
+        Stops the senders. Payloads that were not sent stay in the journal.
+        """
+        self.__stop.set()
+        self.__wakeup.set()
+        deadline = time.monotonic() + timeout
+        for sender in self.__senders:
+            sender.join(max(0.0, deadline - time.monotonic()))
+
+    def __send(self):
+        while not self.__stop.is_set():
+            try:
+                entries = self.__claim()
+            except sqlite3.Error as e:
+                self.__logger.warning(f"{self.__name}: reading outbox failed: {e}")
+                entries = []
+
+            if not entries:
+                self.__wakeup.wait(self.__retry_interval)
+                self.__wakeup.clear()
+                continue
+
+            for entry_id, payload, attempts in entries:
+                try:
+                    self.__deliver(entry_id, payload, attempts)
+                except Exception as e:
+                    # the entry is sent again once its lease expires
+                    self.__logger.warning(
+                        f"{self.__name}: delivering payload failed: {e}"
+                    )
+
+    def __claim(self):
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try:
+                entries = self.__connection.execute(
+                    "SELECT id, payload, attempts FROM outbox "
+                    "WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+                    (now, self.__batch_size),
+                ).fetchall()
+                self.__connection.executemany(
+                    "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                    [(now + self.__lease_time, entry[0]) for entry in entries],
+                )
+                self.__connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.__connection.execute("ROLLBACK")
+                raise
+        return entries
+
+    def __deliver(self, entry_id, payload, attempts):
+        try:
+            data = json.loads(payload)
+        except ValueError as e:
+            self.__logger.warning(
+                f"{self.__name}: dropping malformed payload: {e}"
+            )
+            delivered = True
+        else:
+            try:
+                delivered = self.__handler(data)
+            except Exception as e:
+                self.__logger.debug(
+                    f"{self.__name}: sending payload failed: {e}"
+                )
+                delivered = False
+
+        attempts += 1
+        with self.__lock:
+            if delivered or attempts >= self.__max_attempts:
+                if not delivered:
+                    self.__logger.warning(
+                        f"{self.__name}: giving up on payload after "
+                        f"{attempts} attempts"
+                    )
+                deleted = self.__connection.execute(
+                    "DELETE FROM outbox WHERE id = ? AND payload = ?",
+                    (entry_id, payload),
+                ).rowcount
+                if not deleted:
+                    # replaced while it was being sent, send the new one
+                    self.__connection.execute(
+                        "UPDATE outbox SET attempts = 0, next_attempt = ? "
+                        "WHERE id = ?",
+                        (time.time(), entry_id),
+                    )
+            else:
+                backoff = min(
+                    self.__retry_interval * 2 ** (attempts - 1),
+                    self.__max_retry_interval,
+                )
+                self.__connection.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt = ? "
+                    "WHERE id = ?",
+                    (attempts, time.time() + backoff, entry_id),
+                )
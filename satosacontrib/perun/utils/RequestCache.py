@@ -0,0 +1,133 @@
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from satosa.context import Context
+
+
+def freeze(value: Any) -> Any:
+    """
+    Converts lists, sets and dicts to hashable equivalents, so that they
+    can be a part of a cache key.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+class RequestCache:
+    """
+    Memo of Perun lookups shared by all microservices handling one
+    authentication. The memo is stored on the SATOSA context when the
+    first microservice of the chain starts processing and it is dropped
+    when that microservice returns.
+    """
+
+    CONTEXT_KEY = "perun_request_cache"
+
+    __local = threading.local()
+
+    @staticmethod
+    @contextmanager
+    def scope(context: Optional[Context]):
+        memo = None
+        is_owner = False
+        if context is not None:
+            memo = context.get_decoration(RequestCache.CONTEXT_KEY)
+            if memo is None:
+                memo = {}
+                is_owner = True
+                context.decorate(RequestCache.CONTEXT_KEY, memo)
+
+        stack = RequestCache.__stack()
+        stack.append(memo)
+        try:
+            yield memo
+        finally:
+            stack.pop()
+            if is_owner:
+                context.internal_data.pop(RequestCache.CONTEXT_KEY, None)
+
+    @staticmethod
+    def current() -> Optional[dict]:
+        stack = RequestCache.__stack()
+        return stack[-1] if stack else None
+
+    @staticmethod
+    def scoped(process: Callable) -> Callable:
+        """
+        Decorator of microservice process methods which makes the lookups
+        done while processing the request use the request memo.
+        """
+
+        @functools.wraps(process)
+        def wrapper(self, context, *args, **kwargs):
+            with RequestCache.scope(context):
+                return process(self, context, *args, **kwargs)
+
+        return wrapper
+
+    @staticmethod
+    def __stack():
+        if not hasattr(RequestCache.__local, "stack"):
+            RequestCache.__local.stack = []
+        return RequestCache.__local.stack
+
+
+class RequestCachedAdaptersManager:
+    """
+    Wraps AdaptersManager, so that identical lookups (get_*, has_*, is_*
+    methods called with the same arguments) reach Perun only once per
+    request. Any other method call clears the request memo. Outside of a
+    request scope, all calls go straight to the AdaptersManager.
+    """
+
+    CACHED_PREFIXES = ("get_", "has_", "is_")
+
+    def __init__(self, adapters_manager):
+        self.__adapters_manager = adapters_manager
+
+    def __getattr__(self, name):
+        method = getattr(self.__adapters_manager, name)
+        if not callable(method):
+            return method
+
+        if not name.startswith(self.CACHED_PREFIXES):
+
+            @functools.wraps(method)
+            def invalidating(*args, **kwargs):
+                memo = RequestCache.current()
+                if memo is not None:
+                    memo.clear()
+                return method(*args, **kwargs)
+
+            return invalidating
+
+        @functools.wraps(method)
+        def cached(*args, **kwargs):
+            memo = RequestCache.current()
+            if memo is None:
+                return method(*args, **kwargs)
+            try:
+                # managers of differently configured microservices share
+                # the memo, so the key includes the wrapped manager
+                key = (
+                    id(self.__adapters_manager),
+                    name,
+                    freeze(args),
+                    freeze(kwargs),
+                )
+                hash(key)
+            except TypeError:
+                return method(*args, **kwargs)
+
+            if key not in memo:
+                memo[key] = method(*args, **kwargs)
+            return memo[key]
+
+        return cached
@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from perun.connector.utils.Logger import Logger
+
+
+class WorkerPool:
+    """
+    Fixed number of worker threads consuming tasks from a bounded queue.
+
+    When the queue is full, the overflow policy decides what happens to
+    a new task:
+        drop_oldest - the oldest queued task is discarded
+        drop_newest - the new task is discarded
+        run_inline  - the new task runs in the calling thread
+
+    If on_drop is given, it is called with the target and arguments of
+    every dropped task.
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    RUN_INLINE = "run_inline"
+    OVERFLOW_POLICIES = [DROP_OLDEST, DROP_NEWEST, RUN_INLINE]
+
+    def __init__(
+        self,
+        name: str,
+        worker_count: int = 4,
+        queue_size: int = 1000,
+        overflow_policy: str = DROP_OLDEST,
+        on_drop: Optional[Callable] = None,
+    ):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unsupported overflow policy '{overflow_policy}', use one "
+                f"of: {', '.join(self.OVERFLOW_POLICIES)}"
+            )
+
+        self.__logger = Logger.get_logger(self.__class__.__name__)
+        self.__name = name
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__overflow_policy = overflow_policy
+        self.__on_drop = on_drop
+        self.__lock = threading.Lock()
+        self.__submit_lock = threading.Lock()
+        self.__closed = False
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_task_latency = 0.0
+
+        self.__workers = [
+            threading.Thread(
+                target=self.__work, name=f"{name}-{i}", daemon=True
+            )
+            for i in range(worker_count)
+        ]
+        for worker in self.__workers:
+            worker.start()
+
+    def submit(self, target: Callable, *args: Any) -> bool:
+        """
+        Schedules target(*args) to be run by one of the workers.
+
+        @return: False if the task was dropped
+        """
+        task = (target, args, time.monotonic())
+        oldest = None
+        # enqueue under the lock, so no task is queued after the sentinels
+        # put by close, where no worker would ever run it
+        with self.__submit_lock:
+            closed = self.__closed
+            if not closed:
+                try:
+                    self.__queue.put_nowait(task)
+                    return True
+                except queue.Full:
+                    pass
+
+                if self.__overflow_policy == self.DROP_OLDEST:
+                    try:
+                        oldest = self.__queue.get_nowait()
+                        self.__queue.put_nowait(task)
+                    except (queue.Empty, queue.Full):
+                        oldest = None
+
+        if closed:
+            self.__drop(task, "pool is closed")
+            return False
+
+        if oldest is not None:
+            self.__drop(oldest, "task queue is full")
+            return True
+
+        if self.__overflow_policy == self.RUN_INLINE:
+            self.__run_task(task)
+            return True
+
+        self.__drop(task, "task queue is full")
+        return False
+
+    def metrics(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "queue_depth": self.__queue.qsize(),
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "failed": self.failed,
+                "last_task_latency": self.last_task_latency,
+            }
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Stops accepting new tasks and waits until the queued ones finish.
+
+        @param timeout: seconds to wait for the queued tasks in total,
+                        None waits until all of them finish
+        """
+        with self.__submit_lock:
+            if self.__closed:
+                return
+            self.__closed = True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for _ in self.__workers:
+                # the queue may stay full while the workers are stuck
+                self.__queue.put(None, timeout=self.__remaining(deadline))
+        except queue.Full:
+            pass
+        for worker in self.__workers:
+            worker.join(self.__remaining(deadline))
+
+        if any(worker.is_alive() for worker in self.__workers):
+            self.__logger.warning(
+                f"{self.__name}: {self.__queue.qsize()} tasks were not "
+                f"finished within {timeout} seconds"
+            )
+
+    @staticmethod
+    def __remaining(deadline):
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    def __drop(self, task, reason):
+        with self.__lock:
+            self.dropped += 1
+        self.__logger.warning(
+            f"{self.__name}: {reason}, dropping task {self.__task_name(task)}"
+        )
+        if self.__on_drop:
+            target, args, _ = task
+            self.__on_drop(target, *args)
+
+    def __work(self):
+        while True:
+            task = self.__queue.get()
+            if task is None:
+                return
+            self.__run_task(task)
+
+    def __run_task(self, task):
+        target, args, submitted_at = task
+        try:
+            target(*args)
+            failed = False
+        except Exception as e:
+            self.__logger.warning(
+                f"{self.__name}: task {self.__task_name(task)} failed: {e}"
+            )
+            failed = True
+
+        with self.__lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.last_task_latency = time.monotonic() - submitted_at
+
+    @staticmethod
+    def __task_name(task):
+        return getattr(task[0], "__name__", repr(task[0]))
@@ -0,0 +1,36 @@
+from unittest.mock import patch
+
+from satosacontrib.perun.utils.AdaptersManagerRegistry import (
+    AdaptersManagerRegistry,
+)
+
+ADAPTERS_MANAGER_CFG = {
+    "adapters": [
+        {"type": "rpc", "priority": 1},
+        {"type": "ldap", "priority": 2},
+    ]
+}
+
+
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.__init__",
+    return_value=None,
+)
+def test_adapters_manager_is_shared_per_config(mock_init):
+    AdaptersManagerRegistry.clear()
+
+    first = AdaptersManagerRegistry.get_adapters_manager(
+        ADAPTERS_MANAGER_CFG, {"attr": "value"}
+    )
+    second = AdaptersManagerRegistry.get_adapters_manager(
+        {"adapters": list(ADAPTERS_MANAGER_CFG["adapters"])},
+        {"attr": "value"},
+    )
+    other = AdaptersManagerRegistry.get_adapters_manager(
+        ADAPTERS_MANAGER_CFG, {"attr": "other value"}
+    )
+
+    assert first is second
+    assert first is not other
+    assert mock_init.call_count == 2
+    AdaptersManagerRegistry.clear()
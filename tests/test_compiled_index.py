@@ -0,0 +1,52 @@
+import pytest
+
+from satosacontrib.perun.utils.CompiledIndex import CompiledIndex
+
+ITEMS = {
+    "https://idp{}.example.org/idp".format(i): {"display_name": [{"text": str(i)}]}
+    for i in range(100)
+}
+ITEMS["https://idp.example.org/žluťoučký"] = {"display_name": []}
+
+
+def test_lookup(tmp_path):
+    path = str(tmp_path / "index.idx")
+    CompiledIndex.write(path, ITEMS)
+    index = CompiledIndex(path)
+
+    assert len(index) == len(ITEMS)
+    for key, value in ITEMS.items():
+        assert index.get(key) == value
+    assert index.get("https://unknown.example.org/idp") is None
+    assert index.get("") is None
+    index.close()
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / "index.idx")
+    CompiledIndex.write(path, {})
+
+    assert CompiledIndex(path).get("https://idp.example.org/idp") is None
+
+
+def test_replaced_index(tmp_path):
+    path = str(tmp_path / "index.idx")
+    CompiledIndex.write(path, ITEMS)
+    index = CompiledIndex(path)
+    assert not index.is_replaced()
+
+    CompiledIndex.write(path, {})
+
+    assert index.is_replaced()
+    assert index.get("https://idp1.example.org/idp") == ITEMS[
+        "https://idp1.example.org/idp"
+    ]
+    assert [path.name for path in tmp_path.iterdir()] == ["index.idx"]
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / "index.idx"
+    path.write_bytes(b"<xml>not an index</xml>")
+
+    with pytest.raises(ValueError):
+        CompiledIndex(str(path))
@@ -0,0 +1,340 @@
+import fcntl
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import MagicMock, patch
+
+import pytest
+from satosa.context import Context
+from satosa.internal import InternalData
+
+from satosacontrib.perun.micro_services.context_attributes_microservice import (
+    ContextAttributes,
+    get_idp_metadata,
+)
+from satosacontrib.perun.utils.FederationMetadata import (
+    FederationMetadata,
+    iter_ui_infos,
+)
+
+FEDERATION_URL = "https://metadata.example.org/entities/federation"
+
+FEDERATION_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<md:EntitiesDescriptor xmlns:md="urn:oasis:names:tc:SAML:2.0:metadata"
+    xmlns:mdui="urn:oasis:names:tc:SAML:metadata:ui">
+  <md:EntityDescriptor entityID="https://idp1.example.org/idp">
+    <md:IDPSSODescriptor
+        protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+      <md:Extensions>
+        <mdui:UIInfo>
+          <mdui:DisplayName xml:lang="en">IdP One</mdui:DisplayName>
+          <mdui:DisplayName xml:lang="cs">IdP Jedna</mdui:DisplayName>
+          <mdui:Description xml:lang="en">First IdP</mdui:Description>
+          <mdui:Logo height="16" width="16">https://idp1.example.org/logo.png</mdui:Logo>
+        </mdui:UIInfo>
+      </md:Extensions>
+    </md:IDPSSODescriptor>
+  </md:EntityDescriptor>
+  <md:EntityDescriptor entityID="https://idp2.example.org/idp">
+    <md:IDPSSODescriptor
+        protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol"/>
+  </md:EntityDescriptor>
+</md:EntitiesDescriptor>
+"""
+
+IDP1_UI_INFO = {
+    "display_name": [
+        {"lang": "en", "text": "IdP One"},
+        {"lang": "cs", "text": "IdP Jedna"},
+    ],
+    "description": [{"lang": "en", "text": "First IdP"}],
+    "logo": [
+        {
+            "width": "16",
+            "height": "16",
+            "text": "https://idp1.example.org/logo.png",
+        }
+    ],
+}
+
+
+class FederationHandler(BaseHTTPRequestHandler):
+    body = FEDERATION_XML.encode()
+    etag = '"1"'
+    status = 200
+    requests = []
+    released = None
+
+    def do_GET(self):
+        FederationHandler.requests.append(dict(self.headers))
+        if self.released:
+            self.released.wait(5)
+        if self.status != 200:
+            self.send_response(self.status)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", self.etag)
+            self.send_header("Content-Length", str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def federation_server():
+    FederationHandler.body = FEDERATION_XML.encode()
+    FederationHandler.etag = '"1"'
+    FederationHandler.status = 200
+    FederationHandler.requests = []
+    FederationHandler.released = None
+    server = HTTPServer(("127.0.0.1", 0), FederationHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/entities/federation".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def create_federation(tmp_path):
+    (tmp_path / "federation.xml").write_text(FEDERATION_XML)
+    return FederationMetadata(FEDERATION_URL, str(tmp_path))
+
+
+def test_get_idp_metadata(tmp_path):
+    federations = [create_federation(tmp_path)]
+
+    assert (
+        get_idp_metadata("https://idp1.example.org/idp", federations)
+        == IDP1_UI_INFO
+    )
+    assert get_idp_metadata("https://idp2.example.org/idp", federations) == {
+        "display_name": [],
+        "description": [],
+        "logo": [],
+    }
+    assert get_idp_metadata("https://unknown.example.org/idp", federations) is None
+
+
+def test_federation_is_parsed_once(tmp_path):
+    federation = create_federation(tmp_path)
+    federation.get_ui_info("https://idp1.example.org/idp")
+
+    (tmp_path / "federation.xml").unlink()
+
+    assert federation.get_ui_info("https://idp1.example.org/idp") == IDP1_UI_INFO
+
+
+def test_iter_ui_infos(tmp_path):
+    (tmp_path / "federation.xml").write_text(FEDERATION_XML)
+
+    entities = iter_ui_infos(str(tmp_path / "federation.xml"))
+    entity_id, ui_info = next(entities)
+
+    assert entity_id == "https://idp1.example.org/idp"
+    assert ui_info == IDP1_UI_INFO
+    assert [entity_id for entity_id, _ in entities] == [
+        "https://idp2.example.org/idp"
+    ]
+
+
+def test_refresh_uses_conditional_requests(tmp_path, federation_server):
+    federation = FederationMetadata(federation_server, str(tmp_path))
+
+    assert federation.get_ui_info("https://idp1.example.org/idp") == IDP1_UI_INFO
+    assert not federation.refresh()
+    assert FederationHandler.requests[-1]["If-None-Match"] == '"1"'
+
+    FederationHandler.body = FEDERATION_XML.replace("IdP One", "IdP 1").encode()
+    FederationHandler.etag = '"2"'
+    assert federation.refresh()
+    ui_info = federation.get_ui_info("https://idp1.example.org/idp")
+    assert ui_info["display_name"][0]["text"] == "IdP 1"
+    assert len(FederationHandler.requests) == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "federation.idx",
+        "federation.lock",
+        "federation.validators",
+        "federation.xml",
+    ]
+
+
+def test_failed_refresh_keeps_last_index(tmp_path, federation_server):
+    federation = FederationMetadata(federation_server, str(tmp_path))
+    federation.get_ui_info("https://idp1.example.org/idp")
+
+    FederationHandler.status = 500
+    FederationHandler.etag = '"2"'
+    with pytest.raises(Exception):
+        federation.refresh()
+
+    FederationHandler.status = 200
+    FederationHandler.body = b"<broken"
+    with pytest.raises(Exception):
+        federation.refresh()
+
+    assert federation.get_ui_info("https://idp1.example.org/idp") == IDP1_UI_INFO
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "federation.idx",
+        "federation.lock",
+        "federation.validators",
+        "federation.xml",
+    ]
+
+
+def test_background_refresh(tmp_path, federation_server):
+    FederationHandler.body = FEDERATION_XML.replace("IdP One", "IdP 1").encode()
+    create_federation(tmp_path)
+    federation = FederationMetadata(federation_server, str(tmp_path), 0.05)
+
+    try:
+        for _ in range(100):
+            ui_info = federation.get_ui_info("https://idp1.example.org/idp")
+            if ui_info and ui_info["display_name"][0]["text"] == "IdP 1":
+                break
+            threading.Event().wait(0.05)
+        assert ui_info["display_name"][0]["text"] == "IdP 1"
+        assert "If-Modified-Since" in FederationHandler.requests[0]
+    finally:
+        federation.close()
+
+
+def test_lookups_miss_until_first_refresh(tmp_path, federation_server):
+    FederationHandler.released = threading.Event()
+    federation = FederationMetadata(federation_server, str(tmp_path), 60)
+
+    try:
+        assert federation.get_ui_info("https://idp1.example.org/idp") is None
+        FederationHandler.released.set()
+        for _ in range(100):
+            ui_info = federation.get_ui_info("https://idp1.example.org/idp")
+            if ui_info:
+                break
+            threading.Event().wait(0.05)
+        assert ui_info == IDP1_UI_INFO
+        assert len(FederationHandler.requests) == 1
+    finally:
+        federation.close()
+
+
+def test_workers_share_validators_and_index(tmp_path, federation_server):
+    federation = FederationMetadata(federation_server, str(tmp_path))
+    other_federation = FederationMetadata(federation_server, str(tmp_path))
+    federation.get_ui_info("https://idp1.example.org/idp")
+
+    assert not other_federation.refresh()
+    assert FederationHandler.requests[-1]["If-None-Match"] == '"1"'
+
+    FederationHandler.body = FEDERATION_XML.replace("IdP One", "IdP 1").encode()
+    FederationHandler.etag = '"2"'
+    assert federation.refresh()
+    assert not other_federation.refresh()
+
+    ui_info = other_federation.get_ui_info("https://idp1.example.org/idp")
+    assert ui_info["display_name"][0]["text"] == "IdP 1"
+    assert len(FederationHandler.requests) == 4
+
+
+def test_refresh_waits_for_other_workers(tmp_path, federation_server):
+    federation = FederationMetadata(federation_server, str(tmp_path))
+    federation.get_ui_info("https://idp1.example.org/idp")
+    refreshed = threading.Event()
+
+    def refresh():
+        federation.refresh()
+        refreshed.set()
+
+    with open(federation.lock_path) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        threading.Thread(target=refresh, daemon=True).start()
+        assert not refreshed.wait(0.2)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    assert refreshed.wait(5)
+
+
+def test_index_on_disk_is_served_while_other_worker_refreshes(
+    tmp_path, federation_server
+):
+    FederationMetadata(federation_server, str(tmp_path)).get_ui_info(
+        "https://idp1.example.org/idp"
+    )
+    federation = FederationMetadata(federation_server, str(tmp_path), 60)
+
+    try:
+        with open(federation.lock_path) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for _ in range(100):
+                ui_info = federation.get_ui_info("https://idp1.example.org/idp")
+                if ui_info:
+                    break
+                threading.Event().wait(0.05)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        assert ui_info == IDP1_UI_INFO
+    finally:
+        federation.close()
+
+
+def test_compiled_index_is_shared(tmp_path):
+    create_federation(tmp_path).get_ui_info("https://idp1.example.org/idp")
+    (tmp_path / "federation.xml").unlink()
+
+    federation = FederationMetadata(FEDERATION_URL, str(tmp_path))
+
+    assert federation.get_ui_info("https://idp1.example.org/idp") == IDP1_UI_INFO
+
+
+def create_backend(name, ui_info):
+    entity_descriptor = MagicMock()
+    entity_descriptor.to_dict.return_value = {"service": {"idp": {"ui_info": ui_info}}}
+    backend = MagicMock()
+    backend.name = name
+    backend.get_metadata_desc.return_value = [entity_descriptor]
+    return backend
+
+
+@patch(
+    "satosacontrib.perun.micro_services.context_attributes_microservice.load_backends"
+)
+@patch(
+    "satosacontrib.perun.micro_services.context_attributes_microservice.SATOSAConfig"
+)
+def test_backend_ui_info_is_cached(satosa_config, load_backends, tmp_path):
+    config_file = tmp_path / "proxy_conf.yaml"
+    config_file.write_text("BACKEND_MODULES: []")
+    satosa_config.return_value = {"BACKEND_MODULES": [], "INTERNAL_ATTRIBUTES": {}}
+    google = create_backend("google", {"display_name": [{"text": "Google"}]})
+    load_backends.return_value = [google, create_backend("github", {})]
+
+    microservice = ContextAttributes({}, "ContextAttributes", "base_url")
+    microservice.next = lambda context, data: data
+    context = Context()
+    context.target_backend = "google"
+
+    def process():
+        data = InternalData()
+        data["auth_info"]["issuer"] = "https://accounts.google.com"
+        return microservice.process(context, data).attributes
+
+    with patch.dict(os.environ, {"SATOSA_CONFIG": str(config_file)}):
+        for _ in range(3):
+            attributes = process()
+            assert attributes["targetbackend"] == {
+                "display_name": [{"text": "Google"}]
+            }
+            assert attributes["targetissuer"] == "https://accounts.google.com"
+        load_backends.assert_called_once()
+        google.get_metadata_desc.assert_called_once()
+
+        mtime = os.path.getmtime(config_file) + 10
+        os.utime(config_file, (mtime, mtime))
+        process()
+        assert load_backends.call_count == 2
+
+        context.target_backend = "unknown"
+        assert "targetbackend" not in process()
@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from satosacontrib.perun.utils.LookupCache import LookupCache
+
+
+def test_lookups_are_cached():
+    cache = LookupCache(max_size=10, ttl=300, negative_ttl=60)
+    loader = MagicMock(return_value="facility")
+
+    assert cache.get(("facility", "sp1"), loader) == "facility"
+    assert cache.get(("facility", "sp1"), loader) == "facility"
+
+    loader.assert_called_once()
+    assert cache.metrics() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_missing_facility_is_cached_with_negative_ttl():
+    cache = LookupCache(max_size=10, ttl=300, negative_ttl=60)
+    loader = MagicMock(return_value=None)
+
+    assert cache.get(("facility", "sp1"), loader) is None
+    assert cache.get(("facility", "sp1"), loader) is None
+
+    loader.assert_called_once()
+
+
+def test_missing_facility_is_not_cached_without_negative_ttl():
+    cache = LookupCache(max_size=10, ttl=300, negative_ttl=0)
+    loader = MagicMock(return_value=None)
+
+    assert cache.get(("facility", "sp1"), loader) is None
+    assert cache.get(("facility", "sp1"), loader) is None
+
+    assert loader.call_count == 2
+
+
+def test_failed_lookup_is_not_cached():
+    cache = LookupCache()
+    loader = MagicMock(side_effect=[Exception("Perun unavailable"), "facility"])
+
+    with pytest.raises(Exception):
+        cache.get(("facility", "sp1"), loader)
+    assert cache.get(("facility", "sp1"), loader) == "facility"
+
+
+def test_instance_is_shared_by_same_config():
+    config = {"facility_cache_ttl": 120}
+
+    cache = LookupCache.get_instance(config, "facility_cache")
+    assert cache is LookupCache.get_instance(dict(config), "facility_cache")
+    assert cache is not LookupCache.get_instance(config, "other_cache")
+    assert LookupCache.get_instance({"facility_cache_ttl": 0}, "facility_cache") is None
+
+
+def test_only_cacheable_results_are_cached():
+    cache = LookupCache(max_size=10, ttl=60, negative_ttl=0)
+    loader = MagicMock(side_effect=["EXPIRED", "VALID", "INVALID", None])
+
+    def get():
+        return cache.get(
+            ("member_status", 1, "vo"),
+            loader,
+            lambda status: status == "VALID",
+        )
+
+    assert get() == "EXPIRED"
+    assert get() == "VALID"
+    assert get() == "VALID"
+    assert loader.call_count == 2
+
+
+def test_invalidate_where():
+    cache = LookupCache(max_size=10, ttl=60, negative_ttl=0)
+    cache.get(("member_status", 1, "vo"), lambda: "VALID")
+    cache.get(("member_status", 2, "vo"), lambda: "VALID")
+
+    cache.invalidate_where(lambda key: key[1] == 1)
+
+    assert cache.get(("member_status", 1, "vo"), lambda: None) is None
+    assert cache.get(("member_status", 2, "vo"), lambda: None) == "VALID"
+    assert cache.metrics()["size"] == 1
@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+
+from satosacontrib.perun.utils.Outbox import Outbox
+
+
+class Handler:
+    def __init__(self, failures=0, expected=1):
+        self.failures = failures
+        self.expected = expected
+        self.payloads = []
+        self.done = threading.Event()
+
+    def __call__(self, payload):
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.payloads.append(payload)
+        if len(self.payloads) >= self.expected:
+            self.done.set()
+        return True
+
+
+def test_payloads_are_delivered(tmp_path):
+    handler = Handler()
+    outbox = Outbox(str(tmp_path), "test", handler, retry_interval=0.01)
+
+    outbox.append(["idp", "user"], {"attributes": {"cn": ["Joe"]}})
+
+    assert handler.done.wait(5)
+    outbox.close()
+    assert handler.payloads == [{"attributes": {"cn": ["Joe"]}}]
+    assert outbox.pending() == 0
+
+
+def test_failed_payloads_are_retried(tmp_path):
+    handler = Handler(failures=2)
+    outbox = Outbox(str(tmp_path), "test", handler, retry_interval=0.01)
+
+    outbox.append("key", "payload")
+
+    assert handler.done.wait(5)
+    outbox.close()
+    assert handler.payloads == ["payload"]
+
+
+def test_payloads_survive_restart_and_are_replaced_by_key(tmp_path):
+    outbox = Outbox(str(tmp_path), "test", Handler())
+    outbox.close()
+    outbox.append("key", "first")
+    outbox.append("key", "second")
+    outbox.append("other", "third")
+    assert outbox.pending() == 2
+
+    handler = Handler(expected=2)
+    restarted = Outbox(str(tmp_path), "test", handler, retry_interval=0.01)
+    assert handler.done.wait(5)
+    restarted.close()
+    assert handler.payloads == ["second", "third"]
+
+
+def test_sender_survives_malformed_payloads(tmp_path):
+    handler = Handler()
+    outbox = Outbox(str(tmp_path), "test", handler, retry_interval=0.01)
+    connection = sqlite3.connect(str(tmp_path / "test.sqlite"))
+    with connection:
+        connection.execute(
+            "INSERT INTO outbox (key, payload, next_attempt) "
+            "VALUES ('broken', '{broken', 0)"
+        )
+    connection.close()
+
+    outbox.append("key", "payload")
+
+    assert handler.done.wait(5)
+    outbox.close()
+    assert handler.payloads == ["payload"]
+    assert outbox.pending() == 0
+
+
+def test_payload_replaced_while_sending_waits_for_previous(tmp_path):
+    payloads = []
+    started = threading.Event()
+    released = threading.Event()
+    done = threading.Event()
+
+    def handler(payload):
+        payloads.append(payload)
+        if payload == "first":
+            started.set()
+            released.wait(5)
+        else:
+            done.set()
+        return True
+
+    outbox = Outbox(
+        str(tmp_path), "test", handler, retry_interval=0.01, sender_count=2
+    )
+    outbox.append("key", "first")
+    assert started.wait(5)
+    outbox.append("key", "second")
+
+    assert not done.wait(0.3)
+    released.set()
+    assert done.wait(5)
+    outbox.close()
+    assert payloads == ["first", "second"]
+    assert outbox.pending() == 0
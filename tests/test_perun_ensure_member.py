@@ -2,6 +2,7 @@ import logging
 import pytest
 
 from perun.connector.adapters.AdaptersManager import AdaptersManager
+from perun.connector.adapters.AdaptersManager import AdaptersManagerNotExistsException # noqa e501
 from tests.test_microservice_loader import Loader, TestData, TestContext
 from satosa.exception import SATOSAError
 from satosacontrib.perun.micro_services.perun_ensure_member import PerunEnsureMember # noqa e501
@@ -41,6 +42,12 @@ TEST_CONTEXT = TestContext()
 TEST_DATA = TestData(DATA, ATTRIBUTES)
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    TEST_INSTANCE._PerunEnsureMember__registration_form_cache.clear()
+    TEST_INSTANCE._PerunEnsureMember__vo_and_group_cache.clear()
+
+
 @patch("satosacontrib.perun.micro_services.perun_ensure_member.PerunEnsureMember._PerunEnsureMember__is_user_in_group") # noqa e501
 @patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_member_status_by_user_and_vo") # noqa e501
 def test_handle_user_valid_in_group(mock_request_1, mock_request_2, caplog):
@@ -415,3 +422,174 @@ def test_process(mock_request_1, mock_request_2, mock_request_3):
     _ = TEST_INSTANCE.process(TEST_CONTEXT, TestData(DATA, data))
     PerunEnsureMember._PerunEnsureMember__handle_user.assert_called()
     ResponseMicroService.process.assert_called()
+
+
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_group_by_name") # noqa e501
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.has_registration_form_group") # noqa e501
+def test_group_has_registration_form_is_cached(mock_request_1, mock_request_2):
+    AdaptersManager.get_group_by_name = MagicMock(return_value=TEST_GROUP)
+    AdaptersManager.has_registration_form_group = MagicMock(
+        return_value=False
+    )
+
+    group_has_registration_form = \
+        PerunEnsureMember._PerunEnsureMember__group_has_registration_form
+
+    for _ in range(2):
+        assert not group_has_registration_form(TEST_INSTANCE, TEST_VO)
+
+    AdaptersManager.has_registration_form_group.assert_called_once_with(
+        TEST_GROUP
+    )
+
+
+def create_counted_instance(
+    member_status, member_groups, vo_has_form, group_has_form
+):
+    instance = Loader(CONFIG, PerunEnsureMember.__name__).create_mocked_instance() # noqa e501
+    instance.register = MagicMock()
+    instance.unauthorized = MagicMock()
+    AdaptersManager.get_member_status_by_user_and_vo = MagicMock(
+        return_value=member_status
+    )
+    AdaptersManager.get_groups_where_user_as_member_is_active = MagicMock(
+        return_value=member_groups
+    )
+    AdaptersManager.has_registration_form_vo = MagicMock(
+        return_value=vo_has_form
+    )
+    AdaptersManager.get_group_by_name = MagicMock(return_value=TEST_GROUP)
+    AdaptersManager.has_registration_form_group = MagicMock(
+        return_value=group_has_form
+    )
+    return instance
+
+
+def count_adapter_calls():
+    return {
+        'member_status':
+            AdaptersManager.get_member_status_by_user_and_vo.call_count,
+        'member_groups':
+            AdaptersManager.get_groups_where_user_as_member_is_active.call_count, # noqa e501
+        'vo_form': AdaptersManager.has_registration_form_vo.call_count,
+        'group': AdaptersManager.get_group_by_name.call_count,
+        'group_form': AdaptersManager.has_registration_form_group.call_count,
+    }
+
+
+GROUP_NAMED_AS_CONFIGURED = Group(2, TEST_VO, 'uuid', 'group_name', 'vo:group_name', '') # noqa e501
+
+
+@pytest.mark.parametrize(
+    'member_status, member_groups, vo_has_form, group_has_form, expected',
+    [
+        (
+            MemberStatusEnum.VALID, [GROUP_NAMED_AS_CONFIGURED], True, True,
+            {'member_status': 1, 'member_groups': 1, 'vo_form': 0,
+             'group': 0, 'group_form': 0}
+        ),
+        (
+            MemberStatusEnum.VALID, [], True, True,
+            {'member_status': 1, 'member_groups': 1, 'vo_form': 0,
+             'group': 1, 'group_form': 1}
+        ),
+        (
+            None, [], False, True,
+            {'member_status': 1, 'member_groups': 0, 'vo_form': 1,
+             'group': 0, 'group_form': 0}
+        ),
+        (
+            None, [GROUP_NAMED_AS_CONFIGURED], True, True,
+            {'member_status': 1, 'member_groups': 1, 'vo_form': 1,
+             'group': 0, 'group_form': 0}
+        ),
+        (
+            MemberStatusEnum.EXPIRED, [], True, False,
+            {'member_status': 1, 'member_groups': 1, 'vo_form': 1,
+             'group': 1, 'group_form': 1}
+        ),
+    ]
+)
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.has_registration_form_group") # noqa e501
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_group_by_name") # noqa e501
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.has_registration_form_vo") # noqa e501
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_groups_where_user_as_member_is_active") # noqa e501
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_member_status_by_user_and_vo") # noqa e501
+def test_handle_user_adapter_calls(
+    mock_request_1, mock_request_2, mock_request_3, mock_request_4,
+    mock_request_5, member_status, member_groups, vo_has_form,
+    group_has_form, expected
+):
+    instance = create_counted_instance(
+        member_status, member_groups, vo_has_form, group_has_form
+    )
+
+    instance._PerunEnsureMember__handle_user(
+        TEST_USER, TEST_VO, TEST_DATA, TEST_CONTEXT
+    )
+
+    assert count_adapter_calls() == expected
+
+
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_vo") # noqa e501
+@patch("satosacontrib.perun.micro_services.perun_ensure_member.PerunEnsureMember._PerunEnsureMember__handle_user") # noqa e501
+@patch("satosa.micro_services.base.ResponseMicroService.process")
+def test_process_resolves_vo_once(
+    mock_request_1, mock_request_2, mock_request_3
+):
+    data = {
+        'example_user_id': 1
+    }
+    AdaptersManager.get_vo = MagicMock(return_value=TEST_VO)
+    PerunEnsureMember._PerunEnsureMember__handle_user = MagicMock(
+        return_value=None
+    )
+    ResponseMicroService.process = MagicMock(return_value=None)
+
+    for _ in range(2):
+        TEST_INSTANCE.process(TEST_CONTEXT, TestData(DATA, data))
+    AdaptersManager.get_vo.assert_called_once()
+
+    PerunEnsureMember._PerunEnsureMember__handle_user = MagicMock(
+        side_effect=AdaptersManagerNotExistsException('VO does not exist')
+    )
+    with pytest.raises(AdaptersManagerNotExistsException):
+        TEST_INSTANCE.process(TEST_CONTEXT, TestData(DATA, data))
+
+    PerunEnsureMember._PerunEnsureMember__handle_user = MagicMock(
+        return_value=None
+    )
+    TEST_INSTANCE.process(TEST_CONTEXT, TestData(DATA, data))
+    assert AdaptersManager.get_vo.call_count == 2
+
+
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_groups_where_user_as_member_is_active") # noqa e501
+def test_group_membership_is_cached_per_group(mock_request_1):
+    instance = Loader(
+        dict(CONFIG, membership_cache_ttl=60), PerunEnsureMember.__name__
+    ).create_mocked_instance()
+    other_instance = Loader(
+        dict(CONFIG, membership_cache_ttl=60, group_name='other_group'),
+        PerunEnsureMember.__name__
+    ).create_mocked_instance()
+    instance._PerunEnsureMember__membership_cache.clear()
+    other_group = Group(3, TEST_VO, 'uuid', 'other_group', 'vo:other_group', '') # noqa e501
+    AdaptersManager.get_groups_where_user_as_member_is_active = MagicMock(
+        return_value=[GROUP_NAMED_AS_CONFIGURED]
+    )
+
+    assert instance._PerunEnsureMember__is_user_in_group(TEST_USER, TEST_VO)
+    assert not other_instance._PerunEnsureMember__is_user_in_group(
+        TEST_USER, TEST_VO
+    )
+
+    # the user joined the other group, which the cached membership in the
+    # first group must not hide
+    AdaptersManager.get_groups_where_user_as_member_is_active.return_value = [
+        GROUP_NAMED_AS_CONFIGURED, other_group
+    ]
+    assert instance._PerunEnsureMember__is_user_in_group(TEST_USER, TEST_VO)
+    assert other_instance._PerunEnsureMember__is_user_in_group(
+        TEST_USER, TEST_VO
+    )
+    assert AdaptersManager.get_groups_where_user_as_member_is_active.call_count == 3 # noqa e501
@@ -0,0 +1,162 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import sqlalchemy
+
+from satosacontrib.perun.micro_services.proxystatistics_microservice import ProxyStatistics, StatisticsWriter # noqa e501
+from satosacontrib.perun.utils.TTLCache import TTLCache
+
+
+class SavedLogins:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.released = threading.Event()
+
+    def __call__(self, logins, sp_names):
+        self.released.wait(5)
+        if self.fail:
+            raise Exception("database is down")
+        self.batches.append((logins, sp_names))
+
+
+def test_writer_aggregates_logins():
+    saved = SavedLogins()
+    saved.released.set()
+    writer = StatisticsWriter(saved, 100, 100, 60)
+
+    writer.push("2022-01-01", "idp", "sp", "SP", "user1")
+    writer.push("2022-01-01", "idp", "sp", "SP name", "user1")
+    writer.push("2022-01-01", "idp", "sp", "SP name", "user2")
+    writer.close()
+
+    assert saved.batches == [
+        (
+            {
+                ("2022-01-01", "idp", "sp", "user1"): 2,
+                ("2022-01-01", "idp", "sp", "user2"): 1,
+            },
+            {"sp": "SP name"},
+        )
+    ]
+    assert writer.metrics()["flushed"] == 3
+    assert writer.metrics()["queue_depth"] == 0
+
+
+def test_writer_flushes_on_size():
+    saved = SavedLogins()
+    saved.released.set()
+    writer = StatisticsWriter(saved, 100, 2, 60)
+
+    for user in ["user1", "user2", "user3"]:
+        writer.push("2022-01-01", "idp", "sp", "SP", user)
+    writer.close()
+
+    assert [len(logins) for logins, _ in saved.batches] == [2, 1]
+
+
+def test_writer_counts_dropped_logins():
+    saved = SavedLogins(fail=True)
+    writer = StatisticsWriter(saved, 1, 1, 60)
+
+    pushed = [
+        writer.push("2022-01-01", "idp", "sp", "SP", f"user{i}")
+        for i in range(5)
+    ]
+    saved.released.set()
+    writer.close()
+
+    assert not all(pushed)
+    assert writer.metrics()["dropped"] == 5
+    assert writer.metrics()["flushed"] == 0
+
+
+def test_writer_close_is_bounded_when_database_stalls():
+    saved = SavedLogins()
+    writer = StatisticsWriter(saved, 1, 1, 60)
+    writer.push("2022-01-01", "idp", "sp", "SP", "user1")
+    # the first login is being written, the second one fills the queue
+    while writer.metrics()["queue_depth"]:
+        time.sleep(0.01)
+    writer.push("2022-01-01", "idp", "sp", "SP", "user2")
+
+    started = time.monotonic()
+    writer.close(0.2)
+
+    assert time.monotonic() - started < 2
+    assert writer.metrics()["dropped"] == 1
+    assert writer.metrics()["queue_depth"] == 0
+    assert not writer.push("2022-01-01", "idp", "sp", "SP", "user3")
+    saved.released.set()
+
+
+def test_entity_ids_are_cached():
+    statistics = ProxyStatistics.__new__(ProxyStatistics)
+    statistics.id_cache = TTLCache(10, 60)
+    table = sqlalchemy.Table(
+        "statistics_sp",
+        sqlalchemy.MetaData(),
+        sqlalchemy.Column("sp_id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("identifier", sqlalchemy.String),
+        sqlalchemy.Column("name", sqlalchemy.String),
+    )
+    cnxn = MagicMock()
+    cnxn.execute.return_value.scalar.return_value = 7
+
+    for name in ["SP", "SP", "", "Renamed SP"]:
+        sp_id = statistics._get_id_from_identifier(
+            cnxn, table, {"id": "sp", "name": name}, "sp_id"
+        )
+        assert sp_id == 7
+
+    # upsert and select for the first login and for the renamed SP only
+    assert cnxn.execute.call_count == 4
+
+
+def test_entity_ids_are_resolved_in_one_statement():
+    statistics = ProxyStatistics.__new__(ProxyStatistics)
+    statistics.metadata = sqlalchemy.MetaData()
+    statistics._declare_tables()
+    statistics.statistics_idp = statistics.metadata.tables["statistics_idp"]
+    statistics.statistics_sp = statistics.metadata.tables["statistics_sp"]
+    statistics.returning_ids = True
+    statistics.id_cache = TTLCache(10, 60)
+    cnxn = MagicMock()
+    cnxn.execute.return_value = [
+        ("statistics_idp", "idp", 1),
+        ("statistics_sp", "sp", 2),
+    ]
+
+    for _ in range(2):
+        ids = statistics._get_ids_from_identifiers(
+            cnxn, {"idp": ""}, {"sp": "SP"}
+        )
+        assert ids == ({"idp": 1}, {"sp": 2})
+
+    cnxn.execute.assert_called_once()
+
+
+def test_entity_ids_missing_in_returning_are_resolved_separately():
+    statistics = ProxyStatistics.__new__(ProxyStatistics)
+    statistics.metadata = sqlalchemy.MetaData()
+    statistics._declare_tables()
+    statistics.statistics_idp = statistics.metadata.tables["statistics_idp"]
+    statistics.statistics_sp = statistics.metadata.tables["statistics_sp"]
+    statistics.returning_ids = True
+    statistics.id_cache = TTLCache(10, 60)
+    separate_statement = MagicMock()
+    separate_statement.scalar.return_value = 1
+    cnxn = MagicMock()
+    # the IdP was committed by a concurrent worker, so neither the upsert
+    # nor the fallback select return it
+    cnxn.execute.side_effect = [
+        [("statistics_sp", "sp", 2)],
+        MagicMock(),
+        separate_statement,
+    ]
+
+    ids = statistics._get_ids_from_identifiers(cnxn, {"idp": ""}, {"sp": "SP"})
+
+    assert ids == ({"idp": 1}, {"sp": 2})
+    assert cnxn.execute.call_count == 3
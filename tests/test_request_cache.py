@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+
+from satosa.context import Context
+
+from satosacontrib.perun.utils.RequestCache import (
+    RequestCache,
+    RequestCachedAdaptersManager,
+)
+
+
+def create_adapters_manager():
+    adapters_manager = MagicMock()
+    adapters_manager.get_user_attributes = MagicMock(
+        side_effect=lambda user_id, attr_names: {"id": user_id}
+    )
+    return adapters_manager, RequestCachedAdaptersManager(adapters_manager)
+
+
+def test_lookups_are_memoized_within_request():
+    adapters_manager, cached = create_adapters_manager()
+    context = Context()
+
+    with RequestCache.scope(context):
+        assert cached.get_user_attributes(1, ["a", "b"]) == {"id": 1}
+        # nested scopes of later microservices share the memo
+        with RequestCache.scope(context):
+            assert cached.get_user_attributes(1, ["a", "b"]) == {"id": 1}
+            assert cached.get_user_attributes(2, ["a", "b"]) == {"id": 2}
+
+    assert adapters_manager.get_user_attributes.call_count == 2
+    assert context.get_decoration(RequestCache.CONTEXT_KEY) is None
+
+    with RequestCache.scope(context):
+        cached.get_user_attributes(1, ["a", "b"])
+    assert adapters_manager.get_user_attributes.call_count == 3
+
+
+def test_lookups_outside_request_are_not_memoized():
+    adapters_manager, cached = create_adapters_manager()
+
+    cached.get_user_attributes(1, ["a"])
+    with RequestCache.scope(None):
+        cached.get_user_attributes(1, ["a"])
+
+    assert adapters_manager.get_user_attributes.call_count == 2
+
+
+def test_writes_clear_memo():
+    adapters_manager, cached = create_adapters_manager()
+
+    with RequestCache.scope(Context()):
+        cached.get_user_attributes(1, ["a"])
+        cached.set_user_attributes(1, {"a": "value"})
+        cached.get_user_attributes(1, ["a"])
+
+    adapters_manager.set_user_attributes.assert_called_once()
+    assert adapters_manager.get_user_attributes.call_count == 2
+
+
+def test_memo_is_not_shared_between_adapters_managers():
+    adapters_manager, cached = create_adapters_manager()
+    other_adapters_manager, other_cached = create_adapters_manager()
+    other_adapters_manager.get_user_attributes.side_effect = None
+    other_adapters_manager.get_user_attributes.return_value = {"id": "other"}
+    context = Context()
+
+    with RequestCache.scope(context):
+        assert cached.get_user_attributes(1, ["a"]) == {"id": 1}
+        assert other_cached.get_user_attributes(1, ["a"]) == {"id": "other"}
+
+    other_adapters_manager.get_user_attributes.assert_called_once()
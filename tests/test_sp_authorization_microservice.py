@@ -5,6 +5,9 @@ from unittest.mock import patch, MagicMock
 import pytest
 from perun.connector import MemberStatusEnum, Group, VO
 from perun.connector.adapters.AdaptersManager import AdaptersManager
+from perun.connector.adapters.AdaptersManager import (
+    AdaptersManagerNotExistsException,
+)
 from satosa.context import Context
 from satosa.exception import SATOSAError
 from satosa.internal import InternalData
@@ -46,6 +49,12 @@ REGISTRAR_URL = MICROSERVICE._SpAuthorization__REGISTRAR_URL
 REGISTRATION_LINK_ATTR = MICROSERVICE._SpAuthorization__REGISTRATION_LINK_ATTR
 
 
+@pytest.fixture(autouse=True)
+def clear_lookup_caches():
+    MICROSERVICE._SpAuthorization__facility_cache.clear()
+    MICROSERVICE._SpAuthorization__registration_form_cache.clear()
+
+
 def test_initial_misconfiguration():
     bad_config = copy.deepcopy(MICROSERVICE_CONFIG)
     bad_config["filter_config"]["registration_link_attr"] = None
@@ -109,6 +118,23 @@ def test_process_no_facility_found(mock_request_1, caplog):
         assert result is None
 
 
+def test_process_not_existing_facility_is_cached():
+    data = InternalData()
+    data.requester = "sp_without_facility"
+    data.attributes["example_user_id"] = "example user"
+    get_facility = MagicMock(
+        side_effect=AdaptersManagerNotExistsException("Facility not found")
+    )
+
+    with patch.object(
+        AdaptersManager, "get_facility_by_rp_identifier", get_facility
+    ):
+        assert MICROSERVICE.process(None, data) is None
+        assert MICROSERVICE.process(None, data) is None
+
+    get_facility.assert_called_once()
+
+
 @patch(
     "perun.connector.adapters.AdaptersManager.AdaptersManager.get_facility_by_rp_identifier"  # noqa
 )
@@ -947,6 +973,46 @@ def test_get_registration_vo_short_names_non_member_with_form(
         assert has_form_message in caplog.text
 
 
+@patch("perun.connector.adapters.AdaptersManager.AdaptersManager.get_vo")
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.get_member_status_by_user_and_vo"  # noqa
+)
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.has_registration_form_by_vo_short_name"  # noqa
+)
+def test_get_registration_vo_short_names_multiple_vos(
+    mock_request_1, mock_request_2, mock_request_3
+):
+    vos = {
+        "valid": VO(1, "valid", "valid"),
+        "expired": VO(2, "expired", "expired"),
+        "no form": VO(3, "no form", "no form"),
+    }
+    member_statuses = {
+        "valid": MemberStatusEnum("VALID"),
+        "expired": MemberStatusEnum("EXPIRED"),
+        "no form": None,
+    }
+
+    AdaptersManager.get_vo = MagicMock(
+        side_effect=lambda short_name: vos.get(short_name)
+    )
+    AdaptersManager.get_member_status_by_user_and_vo = MagicMock(
+        side_effect=lambda user_id, vo: member_statuses[vo.short_name]
+    )
+    AdaptersManager.has_registration_form_by_vo_short_name = MagicMock(
+        side_effect=lambda short_name: short_name != "no form"
+    )
+
+    result = MICROSERVICE._SpAuthorization__get_registration_vo_short_names(
+        None, vo_short_names=["valid", "missing", "expired", "no form"]
+    )
+
+    assert result == {"valid", "expired"}
+    assert AdaptersManager.get_vo.call_count == 4
+    assert AdaptersManager.get_member_status_by_user_and_vo.call_count == 3
+
+
 @patch(
     "perun.connector.adapters.AdaptersManager.AdaptersManager.get_sp_groups_by_facility"  # noqa
 )
@@ -1010,7 +1076,7 @@ def test_get_registration_groups(mock_request_1, mock_request_2, caplog):
         return_value=sp_groups_on_facility
     )
     AdaptersManager.has_registration_form_group = MagicMock(
-        side_effect=[True, False, True]
+        side_effect=lambda group: group is group_with_registration_form
     )
 
     with caplog.at_level(logging.DEBUG):
@@ -1026,3 +1092,114 @@ def test_get_registration_groups(mock_request_1, mock_request_2, caplog):
                 " registration list."
             )
             assert expected_message in caplog.text
+
+
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.get_sp_groups_by_facility"  # noqa
+)
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.has_registration_form_group"  # noqa
+)
+def test_get_registration_groups_caches_registration_forms(
+    mock_request_1, mock_request_2
+):
+    vo = VO(1, "vo", "vo short name")
+    group_with_form = Group(1, vo, "uuid", "with form", "vo:with form", "")
+    group_without_form = Group(2, vo, "uuid 2", "no form", "vo:no form", "")
+
+    AdaptersManager.get_sp_groups_by_facility = MagicMock(
+        return_value=[group_with_form, group_without_form]
+    )
+    AdaptersManager.has_registration_form_group = MagicMock(
+        side_effect=lambda group: group == group_with_form
+    )
+
+    for _ in range(2):
+        result = MICROSERVICE._SpAuthorization__get_registration_groups(
+            facility=None, vo_short_names_for_registration={"vo short name"}
+        )
+        assert result == [group_with_form]
+
+    assert AdaptersManager.has_registration_form_group.call_count == 2
+    AdaptersManager.has_registration_form_group.assert_any_call(
+        group_with_form
+    )
+    AdaptersManager.has_registration_form_group.assert_any_call(
+        group_without_form
+    )
+
+
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.get_sp_groups_by_facility"  # noqa
+)
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.has_registration_form_group"  # noqa
+)
+def test_get_registration_groups_keeps_order(mock_request_1, mock_request_2):
+    vo = VO(1, "vo", "vo short name")
+    other_vo = VO(2, "other vo", "other vo short name")
+    groups = [
+        Group(i, vo, f"uuid {i}", f"group {i}", f"vo:group {i}", "")
+        for i in range(20)
+    ]
+    other_vo_group = Group(20, other_vo, "uuid", "group", "other:group", "")
+
+    AdaptersManager.get_sp_groups_by_facility = MagicMock(
+        return_value=groups + [other_vo_group]
+    )
+    AdaptersManager.has_registration_form_group = MagicMock(
+        side_effect=lambda group: group.id % 2 == 0
+    )
+
+    microservice = Loader(
+        dict(MICROSERVICE_CONFIG, max_lookup_workers=4),
+        SpAuthorization.__name__,
+    ).create_mocked_instance()
+
+    result = microservice._SpAuthorization__get_registration_groups(
+        facility=None, vo_short_names_for_registration={"vo short name"}
+    )
+
+    assert result == groups[::2]
+    assert AdaptersManager.has_registration_form_group.call_count == 20
+
+
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager"
+    ".get_facility_by_rp_identifier"
+)
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager"
+    ".get_users_groups_on_facility"
+)
+@patch(
+    "satosacontrib.perun.micro_services.sp_authorization_microservice.SpAuthorization"  # noqa
+    "._SpAuthorization__get_sp_attributes"
+)
+@patch("satosa.micro_services.base.MicroService.process")
+def test_process_publishes_users_groups(
+    mock_request_1, mock_request_2, mock_request_3, mock_request_4
+):
+    config = copy.deepcopy(MICROSERVICE_CONFIG)
+    config["publish_user_groups"] = True
+    microservice = Loader(config, SpAuthorization.__name__).create_mocked_instance()  # noqa
+    vo = VO(1, "vo", "vo short name")
+    user_groups = [Group(1, vo, "uuid", "group", "vo:group", "")]
+    data = InternalData()
+    data.attributes["example_user_id"] = "example user"
+
+    AdaptersManager.get_facility_by_rp_identifier = MagicMock(
+        return_value="example facility"
+    )
+    SpAuthorization._SpAuthorization__get_sp_attributes = MagicMock(
+        return_value={"check_group_membership": True}
+    )
+    AdaptersManager.get_users_groups_on_facility = MagicMock(
+        return_value=user_groups
+    )
+    MicroService.process = MagicMock(return_value=None)
+
+    microservice.process(None, data)
+
+    assert data.data["perun"]["groups"] == user_groups
+    MicroService.process.assert_called()
@@ -0,0 +1,50 @@
+from unittest.mock import MagicMock, patch
+
+from satosacontrib.perun.utils.TTLCache import TTLCache
+
+
+def test_get_and_set():
+    cache = TTLCache(10, 60)
+    cache.set("key", "value")
+
+    assert cache.get("key") == "value"
+    assert cache.get("other") is None
+    assert cache.metrics() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_entries_expire():
+    cache = TTLCache(10, 60)
+    with patch("time.monotonic", return_value=100):
+        cache.set("key", "value")
+        cache.set("short", "value", ttl=1)
+    with patch("time.monotonic", return_value=130):
+        assert cache.get("key") == "value"
+        assert cache.get("short") is None
+    with patch("time.monotonic", return_value=161):
+        assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_get_or_load_caches_none():
+    cache = TTLCache(10, 60)
+    loader = MagicMock(return_value=None)
+
+    assert cache.get_or_load("key", loader) is None
+    assert cache.get_or_load("key", loader) is None
+    loader.assert_called_once()
+
+    cache.invalidate("key")
+    cache.get_or_load("key", loader)
+    assert loader.call_count == 2
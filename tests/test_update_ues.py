@@ -1,5 +1,3 @@
-import threading
-
 from perun.connector.adapters.AdaptersManager import AdaptersManager
 from perun.connector.models.User import User
 from perun.connector.models.UserExtSource import UserExtSource
@@ -11,6 +9,7 @@ from unittest.mock import patch, MagicMock
 from tests.test_microservice_loader import Loader, TestData, TestContext
 
 import pytest
+import time
 
 
 CONFIG = {
@@ -215,6 +214,9 @@ def test_run(mock_request_1, mock_request_2, mock_request_3, mock_request_4):
     TEST_INSTANCE._UpdateUserExtSource__update_user_ext_source = MagicMock(
         return_value=True
     )
+    TEST_INSTANCE._UpdateUserExtSource__get_attribute_digests = MagicMock(
+        return_value={}
+    )
 
     result = TEST_INSTANCE._UpdateUserExtSource__run(
         data_to_conversion
@@ -223,16 +225,204 @@ def test_run(mock_request_1, mock_request_2, mock_request_3, mock_request_4):
     assert not result
 
 
-@patch('threading.Thread.start')
+@patch('satosacontrib.perun.utils.WorkerPool.WorkerPool.submit')
 @patch('satosa.micro_services.base.ResponseMicroService.process')
 def test_process(mock_request_1, mock_request_2):
-    threading.Thread.start = MagicMock(
-        return_value=None
-    )
     ResponseMicroService.process = MagicMock(
         return_value=None
     )
 
     _ = TEST_INSTANCE.process(TestContext(), TestData(DATA, {'example_user_id': '1'})) # noqa
-    threading.Thread.start.assert_called()
+    mock_request_2.assert_called()
     ResponseMicroService.process.assert_called()
+
+
+@patch('satosacontrib.perun.utils.WorkerPool.WorkerPool.submit')
+def test_updates_are_coalesced(mock_request_1):
+    config = dict(CONFIG, min_update_interval=60)
+    instance = Loader(config, UpdateUserExtSource.__name__).create_mocked_instance() # noqa e501
+    instance._UpdateUserExtSource__sync = MagicMock(return_value=True)
+    key = ('idp', 'joe@idp')
+
+    instance._UpdateUserExtSource__schedule_update(key, {'login': 1})
+    instance._UpdateUserExtSource__schedule_update(key, {'login': 2})
+    mock_request_1.assert_called_once()
+
+    instance._UpdateUserExtSource__run_pending(key)
+    instance._UpdateUserExtSource__sync.assert_called_once_with({'login': 2})
+
+    instance._UpdateUserExtSource__schedule_update(key, {'login': 3})
+    mock_request_1.assert_called_once()
+
+
+@patch('satosacontrib.perun.utils.WorkerPool.WorkerPool.submit')
+def test_failed_updates_are_not_throttled(mock_request_1):
+    config = dict(CONFIG, min_update_interval=60)
+    instance = Loader(config, UpdateUserExtSource.__name__).create_mocked_instance() # noqa e501
+    instance._UpdateUserExtSource__sync = MagicMock(return_value=False)
+    key = ('idp', 'joe@idp')
+
+    instance._UpdateUserExtSource__schedule_update(key, {'login': 1})
+    instance._UpdateUserExtSource__run_pending(key)
+    instance._UpdateUserExtSource__schedule_update(key, {'login': 2})
+
+    assert mock_request_1.call_count == 2
+
+
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.update_user_ext_source_last_access" # noqa e501
+)
+@patch(
+    "perun.connector.adapters.AdaptersManager.AdaptersManager.set_user_ext_source_attributes" # noqa e501
+)
+def test_unchanged_attributes_are_not_synced(mock_request_1, mock_request_2):
+    instance = Loader(CONFIG, UpdateUserExtSource.__name__).create_mocked_instance() # noqa e501
+    instance._UpdateUserExtSource__find_user_ext_source = MagicMock(
+        return_value=EXT_SOURCE
+    )
+    instance._UpdateUserExtSource__get_attributes_from_perun = MagicMock(
+        return_value={'ues_cn_attr': 'old cn'}
+    )
+    data_to_conversion = {
+        "attributes": ATTRIBUTES,
+        "attr_map": CONFIG['attr_map'],
+        "attrs_to_conversion": CONFIG['array_to_string_conversion'],
+        "append_only_attrs": CONFIG['append_only_attrs'],
+        "perun_user_id": 1,
+        "auth_info": {
+            "issuer": "id"
+        }
+    }
+
+    for _ in range(3):
+        instance._UpdateUserExtSource__run(data_to_conversion)
+
+    instance._UpdateUserExtSource__get_attributes_from_perun.assert_called_once() # noqa e501
+    mock_request_1.assert_called_once()
+    mock_request_2.assert_called_once()
+
+
+def test_find_user_ext_source_parallel_probing():
+    config = dict(CONFIG, parallel_identifier_probing=True)
+    instance = Loader(config, UpdateUserExtSource.__name__).create_mocked_instance() # noqa e501
+    user_ext_sources = {
+        'targeted_id': UserExtSource(2, "ext_source", "targeted_id", USER),
+        'principal_name': UserExtSource(3, "ext_source", "principal_name", USER), # noqa e501
+    }
+    instance._UpdateUserExtSource__get_user_ext_source = MagicMock(
+        side_effect=lambda name, login: user_ext_sources.get(login)
+    )
+    attributes = {
+        'eduperson_targeted_id': ['targeted_id'],
+        'eduperson_unique_id': ['unknown'],
+        'eduperson_principal_name': 'principal_name',
+    }
+
+    result = instance._UpdateUserExtSource__find_user_ext_source(
+        "idp", attributes, CONFIG['user_identifiers']
+    )
+    assert result == user_ext_sources['principal_name']
+
+    del user_ext_sources['principal_name']
+    result = instance._UpdateUserExtSource__find_user_ext_source(
+        "idp", attributes, CONFIG['user_identifiers']
+    )
+    assert result == user_ext_sources['targeted_id']
+
+    # the identifier that matched last time for the IdP is probed first
+    candidates = instance._UpdateUserExtSource__get_identifier_candidates(
+        "idp", attributes, CONFIG['user_identifiers']
+    )
+    assert candidates == [
+        ('eduperson_targeted_id', 'targeted_id'),
+        ('eduperson_unique_id', 'unknown'),
+        ('eduperson_principal_name', 'principal_name'),
+    ]
+
+
+def create_outbox_instance(tmp_path):
+    config = dict(CONFIG, outbox_dir=str(tmp_path), outbox_retry_interval=0.01)
+    instance = Loader(config, UpdateUserExtSource.__name__).create_mocked_instance() # noqa e501
+    instance._UpdateUserExtSource__worker_pool.submit = MagicMock()
+    return instance, instance._UpdateUserExtSource__outbox
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_outbox_updates_are_synced(tmp_path):
+    instance, outbox = create_outbox_instance(tmp_path)
+    instance._UpdateUserExtSource__sync = MagicMock(return_value=True)
+    data_to_conversion = {
+        "attributes": ATTRIBUTES,
+        "perun_user_id": 1,
+        "auth_info": {"issuer": "idp", "auth_class_ref": "password"},
+    }
+
+    instance._UpdateUserExtSource__schedule_update(
+        ('idp', 'joe@idp'), data_to_conversion
+    )
+
+    assert wait_until(lambda: outbox.pending() == 0)
+    outbox.close()
+    instance._UpdateUserExtSource__worker_pool.submit.assert_not_called()
+    instance._UpdateUserExtSource__sync.assert_called_once_with(
+        dict(data_to_conversion, auth_info={"issuer": "idp"})
+    )
+
+
+def test_outbox_drops_updates_of_users_without_ues(tmp_path):
+    instance, outbox = create_outbox_instance(tmp_path)
+    instance._UpdateUserExtSource__find_user_ext_source = MagicMock(
+        return_value=None
+    )
+    data_to_conversion = {
+        "attributes": ATTRIBUTES,
+        "attr_map": CONFIG['attr_map'],
+        "attrs_to_conversion": CONFIG['array_to_string_conversion'],
+        "append_only_attrs": CONFIG['append_only_attrs'],
+        "perun_user_id": 1,
+        "auth_info": {"issuer": "idp"},
+    }
+
+    instance._UpdateUserExtSource__schedule_update(
+        ('idp', 'joe@idp'), data_to_conversion
+    )
+
+    assert wait_until(lambda: outbox.pending() == 0)
+    outbox.close()
+    instance._UpdateUserExtSource__find_user_ext_source.assert_called_once()
+
+
+def test_outbox_retries_updates_when_perun_fails(tmp_path):
+    instance, outbox = create_outbox_instance(tmp_path)
+    instance._UpdateUserExtSource__get_user_ext_source = MagicMock(
+        side_effect=[AdaptersManagerException("Perun is down"), EXT_SOURCE]
+    )
+    instance._UpdateUserExtSource__get_attributes_from_perun = MagicMock(
+        return_value={'ues_cn_attr': 'old cn'}
+    )
+    instance._UpdateUserExtSource__update_user_ext_source = MagicMock(
+        return_value=True
+    )
+    data_to_conversion = {
+        "attributes": {'uid': ['joe'], **ATTRIBUTES},
+        "attr_map": CONFIG['attr_map'],
+        "attrs_to_conversion": CONFIG['array_to_string_conversion'],
+        "append_only_attrs": CONFIG['append_only_attrs'],
+        "perun_user_id": 1,
+        "auth_info": {"issuer": "idp"},
+    }
+
+    instance._UpdateUserExtSource__schedule_update(
+        ('idp', 'joe'), data_to_conversion
+    )
+
+    assert wait_until(lambda: outbox.pending() == 0)
+    outbox.close()
+    assert instance._UpdateUserExtSource__get_user_ext_source.call_count == 2
+    instance._UpdateUserExtSource__update_user_ext_source.assert_called_once()
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from satosacontrib.perun.utils.WorkerPool import WorkerPool
+
+
+def test_tasks_are_run_and_drained_on_close():
+    results = []
+    pool = WorkerPool("test", 2, 10)
+
+    for i in range(5):
+        pool.submit(results.append, i)
+    pool.close()
+
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    assert pool.metrics()["completed"] == 5
+    assert pool.metrics()["queue_depth"] == 0
+    assert not pool.submit(results.append, 5)
+
+
+@pytest.mark.parametrize(
+    "policy,expected_results,expected_dropped",
+    [
+        (WorkerPool.DROP_OLDEST, ["blocking", "new"], 1),
+        (WorkerPool.DROP_NEWEST, ["blocking", "old"], 1),
+        (WorkerPool.RUN_INLINE, ["new", "blocking", "old"], 0),
+    ],
+)
+def test_overflow_policy(policy, expected_results, expected_dropped):
+    results = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_task():
+        started.set()
+        release.wait(5)
+        results.append("blocking")
+
+    pool = WorkerPool("test", 1, 1, policy)
+    pool.submit(blocking_task)
+    started.wait(5)
+    pool.submit(results.append, "old")
+    pool.submit(results.append, "new")
+    release.set()
+    pool.close()
+
+    assert results == expected_results
+    assert pool.metrics()["dropped"] == expected_dropped
+
+
+def test_unsupported_overflow_policy():
+    with pytest.raises(ValueError):
+        WorkerPool("test", 1, 1, "block")
+
+
+def test_close_waits_at_most_timeout():
+    release = threading.Event()
+    pool = WorkerPool("test", 2, 10)
+    pool.submit(release.wait, 5)
+
+    pool.close(timeout=0.1)
+
+    assert not release.is_set()
+    release.set()
+
+
+def test_tasks_submitted_while_closing_are_run_or_dropped():
+    results = []
+    pool = WorkerPool("test", 2, 10000)
+
+    def submit_many():
+        for i in range(1000):
+            pool.submit(results.append, i)
+
+    submitters = [threading.Thread(target=submit_many) for _ in range(4)]
+    for submitter in submitters:
+        submitter.start()
+    pool.close()
+    for submitter in submitters:
+        submitter.join()
+
+    metrics = pool.metrics()
+    assert metrics["completed"] == len(results)
+    assert metrics["completed"] + metrics["dropped"] == 4000
+    assert metrics["queue_depth"] == 0
+
+
+def test_close_is_bounded_when_queue_is_full():
+    release = threading.Event()
+    pool = WorkerPool("test", 2, 2, WorkerPool.DROP_NEWEST)
+    for _ in range(2):
+        pool.submit(release.wait, 5)
+    while pool.metrics()["queue_depth"]:
+        time.sleep(0.01)
+    for _ in range(2):
+        pool.submit(release.wait, 5)
+
+    started = time.monotonic()
+    pool.close(timeout=0.2)
+
+    assert time.monotonic() - started < 2
+    release.set()